@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Compare encodings for streamed bulk records.
+
+Encodes synthetic records shaped like the output of the bulk resource endpoint
+with each of the stream renderers, and reports encode time, decode time, and
+bytes on the wire (uncompressed and gzipped). Does not need a database.
+
+Usage: uv run python benchmarks/bench_bulk_encoding.py [n_records]
+
+"""
+
+import json
+import random
+import struct
+import sys
+import time
+import zlib
+
+import django
+from django.conf import settings
+
+settings.configure()
+django.setup()
+
+from nbank_registry import renderers  # noqa: E402
+from nbank_registry.tools import base36  # noqa: E402
+
+
+def make_records(n, seed=1):
+    rng = random.Random(seed)
+    for _ in range(n):
+        name = base36.hash(rng.randint(0, base36.maximum)).lower()
+        yield {
+            "name": name,
+            "sha1": f"{rng.getrandbits(160):040x}" if rng.random() < 0.2 else None,
+            "dtype": rng.choice(("spike_times", "acoustic_waveform", "intracellular")),
+            "filename": f"{name}.pprox",
+            "metadata": {
+                "experimenter": rng.choice(("dmeliza", "mcb2x", "jt7dz")),
+                "bird": f"C{rng.randint(1, 400)}",
+                "unit": f"st{rng.randint(1, 400)}_{rng.randint(1, 12)}",
+                "depth": round(rng.uniform(100, 3000), 1),
+            },
+            "locations": ["local", "registry"],
+            "created_by": "dmeliza",
+            "created_on": "2024-12-18T00:41:14.439000Z",
+        }
+
+
+def decode_jsonl(data):
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def decode_msgpack_stream(data):
+    out = []
+    pos = 0
+    while pos < len(data):
+        (size,) = struct.unpack_from(">I", data, pos)
+        pos += 4
+        out.append(renderers.msgpack.unpackb(data[pos : pos + size]))
+        pos += size
+    return out
+
+
+def bench(name, renderer, decode, records):
+    start = time.perf_counter()
+    data = b"".join(renderer.render(record) for record in records)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    decoded = decode(data)
+    decode_time = time.perf_counter() - start
+    assert len(decoded) == len(records)
+    gzipped = len(zlib.compress(data, 6))
+    print(
+        f"{name:<10} encode {encode_time:7.3f} s  decode {decode_time:7.3f} s  "
+        f"{len(data) / 1e6:8.2f} MB  ({gzipped / 1e6:6.2f} MB gzipped)"
+    )
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100_000
+    records = list(make_records(n))
+    print(f"{n} records")
+    bench("jsonl", renderers.JSONLRenderer(), decode_jsonl, records)
+    if renderers.msgpack is not None:
+        bench(
+            "msgpack",
+            renderers.MessagePackStreamRenderer(),
+            decode_msgpack_stream,
+            records,
+        )
+    else:
+        print("msgpack is not installed")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
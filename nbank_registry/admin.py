@@ -3,16 +3,63 @@
 from __future__ import unicode_literals
 
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
 
-from nbank_registry.models import Archive, DataType, Location, Resource
+from nbank_registry.models import Archive, DataType, Location, MetadataIndex, Resource
+from nbank_registry.search import ResourceSearchVector, search_query
+
+# unfiltered changelists use the planner's estimate of the number of rows
+# once a table is larger than this
+APPROXIMATE_COUNT_THRESHOLD = 100000
+
+
+def estimated_count(queryset):
+    """Returns the planner's estimate of the number of rows in queryset's table"""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [connection.ops.quote_name(queryset.model._meta.db_table)],
+        )
+        row = cursor.fetchone()
+    # reltuples is -1 if the table has never been analyzed
+    return row[0] if row is not None else -1
+
+
+class ApproximateCountPaginator(Paginator):
+    """Avoids counting every row to paginate a large unfiltered changelist.
+
+    The count is estimated from table statistics, so the number of pages may be
+    slightly off. Filtered lists are counted exactly.
+
+    """
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate > APPROXIMATE_COUNT_THRESHOLD:
+                return estimate
+        return super().count
 
 
 class LocationInline(admin.TabularInline):
     model = Location
+    autocomplete_fields = ("archive",)
+
+
+class MetadataIndexInline(admin.TabularInline):
+    model = MetadataIndex
+    extra = 0
 
 
 class DataTypeAdmin(admin.ModelAdmin):
     list_display = ("name", "content_type", "extension")
+    search_fields = ("name__istartswith",)
+    inlines = (MetadataIndexInline,)
 
 
 class ArchiveAdmin(admin.ModelAdmin):
@@ -22,22 +69,32 @@ class ArchiveAdmin(admin.ModelAdmin):
 
 
 class ResourceAdmin(admin.ModelAdmin):
-    date_hierarchy = "created_on"
     fields = ("name", "sha1", "dtype", "metadata", "created_by")
+    autocomplete_fields = ("dtype", "created_by")
     list_display = ("name", "dtype", "created_by", "created_on")
-    list_filter = (
-        "dtype",
-        "location__archive",
-        "created_by",
-    )
-    search_fields = (
-        "name__istartswith",
-        "sha1__istartswith",
-        "dtype__name",
-        "metadata__icontains",
+    list_select_related = ("dtype", "created_by")
+    list_filter = ("dtype", "location__archive")
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    search_fields = ("name__startswith", "sha1__startswith")
+    search_help_text = (
+        'Search names and metadata values (e.g. HVC "good isolation" -noisy), '
+        "or enter the start of a name or SHA1."
     )
     inlines = (LocationInline,)
 
+    def get_search_results(self, request, queryset, search_term):
+        # uses the full-text index instead of scanning metadata as text
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        queryset = queryset.alias(search=ResourceSearchVector()).filter(
+            Q(search=search_query(term))
+            | Q(name__startswith=term)
+            | Q(sha1__startswith=term)
+        )
+        return queryset, False
+
 
 admin.site.register(Resource, ResourceAdmin)
 admin.site.register(DataType, DataTypeAdmin)
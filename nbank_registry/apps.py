@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class NeurobankConfig(AppConfig):
     name = "nbank_registry"
+
+    def ready(self):
+        from nbank_registry import signals  # noqa: F401
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Caching for small tables that are read on nearly every request.
+
+DataType and Archive records change rarely but are needed to serialize and
+validate every resource. The MetadataIndex configuration is needed to plan
+metadata filters. The tables (and the rendered list views) are kept in
+the Django cache named by NEUROBANK_CACHE (default: "default", which is a
+local-memory cache unless the site configures something else). Entries are
+invalidated by the signal handlers in nbank_registry.signals whenever one of
+these records is saved or deleted. Entries are always filled from the default
+database, even during requests served from a read replica, so that a lagging
+replica can't put stale records back in the cache right after an invalidation.
+
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from nbank_registry.models import Archive, DataType, MetadataIndex
+
+cache_alias = getattr(settings, "NEUROBANK_CACHE", "default")
+cache_timeout = getattr(settings, "NEUROBANK_CACHE_TIMEOUT", 3600)
+
+DATATYPE_INDEX_KEY = "nbank_registry:datatype-index"
+DATATYPE_LIST_KEY = "nbank_registry:datatype-list"
+ARCHIVE_INDEX_KEY = "nbank_registry:archive-index"
+ARCHIVE_LIST_KEY = "nbank_registry:archive-list"
+METADATA_INDEX_KEY = "nbank_registry:metadata-indexes"
+
+# the database that cache entries are filled from
+PRIMARY = DEFAULT_DB_ALIAS
+
+
+def get_cache():
+    return caches[cache_alias]
+
+
+def get_or_set(key, func):
+    """Return the value cached under key, calling func() to populate it on a miss"""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is None:
+        value = func()
+        cache.set(key, value, cache_timeout)
+    return value
+
+
+def _index(queryset):
+    objs = list(queryset)
+    return {
+        "name": {obj.name: obj for obj in objs},
+        "pk": {obj.pk: obj for obj in objs},
+    }
+
+
+def datatype_index():
+    """Returns {"name": {name: DataType}, "pk": {pk: DataType}} for all dtypes"""
+    return get_or_set(
+        DATATYPE_INDEX_KEY, lambda: _index(DataType.objects.using(PRIMARY))
+    )
+
+
+def archive_index():
+    """Returns {"name": {name: Archive}, "pk": {pk: Archive}} for all archives"""
+    return get_or_set(ARCHIVE_INDEX_KEY, lambda: _index(Archive.objects.using(PRIMARY)))
+
+
+def _metadata_index_keys():
+    keys = {}
+    for dtype_id, key in MetadataIndex.objects.using(PRIMARY).values_list(
+        "dtype_id", "key"
+    ):
+        keys.setdefault(dtype_id, set()).add(key)
+    return keys
+
+
+def metadata_index_keys():
+    """Returns {dtype pk: {key, ...}} for all indexed metadata keys"""
+    return get_or_set(METADATA_INDEX_KEY, _metadata_index_keys)
+
+
+def invalidate_datatypes():
+    get_cache().delete_many([DATATYPE_INDEX_KEY, DATATYPE_LIST_KEY])
+
+
+def invalidate_archives():
+    get_cache().delete_many([ARCHIVE_INDEX_KEY, ARCHIVE_LIST_KEY])
+
+
+def invalidate_metadata_indexes():
+    get_cache().delete(METADATA_INDEX_KEY)
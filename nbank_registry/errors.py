@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 # -*- mode: python -*-
+from rest_framework import status
+from rest_framework.exceptions import APIException
 
 
 class NotAvailableForDownloadError(Exception):
@@ -36,3 +38,29 @@ class SchemeNotImplementedError(NotAvailableForDownloadError):
 class NonDownloadableDtypeError(NotAvailableForDownloadError):
     def __str__(self):
         return "The resource is not of a downloadable datatype"
+
+
+class ArchiveUnavailableError(NotAvailableForDownloadError):
+    def __init__(self, archive):
+        self.archive = archive
+
+    def __str__(self):
+        return f"The archive '{self.archive}' is not responding. Try again later."
+
+
+class QueryTimeoutError(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The query took too long to run. Try narrowing the filters or selecting fewer resources."
+    default_code = "query_timeout"
+
+
+class TooManyNamesError(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "The request has too many names."
+    default_code = "too_many_names"
+
+
+class QueryTooExpensiveError(APIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    default_detail = "The query would be too expensive to run. Try adding filters that can use an index, like dtype, name, or created_on."
+    default_code = "query_too_expensive"
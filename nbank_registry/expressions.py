@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Database expressions for modifying resource metadata in place"""
+
+from django.contrib.postgres.fields import ArrayField
+from django.db.models import F, Func, JSONField, TextField, Value
+from django.db.models.functions import Cast, Coalesce
+
+
+class JSONBConcat(Func):
+    """Merges jsonb objects with the || operator. Keys on the right take precedence."""
+
+    arg_joiner = " || "
+    template = "(%(expressions)s)"
+    output_field = JSONField()
+
+
+class JSONBDeleteKeys(Func):
+    """Removes an array of keys from a jsonb object with the - operator"""
+
+    arg_joiner = " - "
+    template = "(%(expressions)s)"
+    output_field = JSONField()
+
+
+def metadata_patch(patch, field="metadata"):
+    """Returns an expression that applies `patch` to a jsonb field.
+
+    Keys in `patch` with values of None are removed; other keys are added or
+    replaced. Keys not in `patch` are left untouched, and NULL is treated as an
+    empty object. Because the merge happens inside the UPDATE statement, only the
+    changed keys are sent to the database, and concurrent patches to different
+    keys do not overwrite each other.
+
+    """
+    updates = {key: value for key, value in patch.items() if value is not None}
+    deletes = [key for key, value in patch.items() if value is None]
+    expr = Coalesce(F(field), Value({}, output_field=JSONField()))
+    if updates:
+        expr = JSONBConcat(expr, Value(updates, output_field=JSONField()))
+    if deletes:
+        expr = JSONBDeleteKeys(expr, Cast(Value(deletes), ArrayField(TextField())))
+    return expr
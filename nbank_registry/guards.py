@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Limits on the queries that clients can design.
+
+The resource list, bulk endpoints, and bulk metadata updates let clients
+filter on arbitrary metadata keys with arbitrary lookups, and some of those
+queries can't use an index. Two optional settings keep them from tying up the
+database:
+
+- NEUROBANK_STATEMENT_TIMEOUT: the maximum run time for each statement, in
+  milliseconds. Queries that take longer are canceled and the client gets a
+  503 response.
+- NEUROBANK_MAX_QUERY_COST: the maximum planner cost estimate for a resource
+  list query with metadata filters or a search. Queries over the limit are
+  rejected with a 400 response before they are run.
+
+Each can be a number, which applies to all clients, or a dict keyed by
+permission level ("anonymous", "authenticated", or "staff"). A missing key
+or a value of None or 0 means no limit. Rejected and canceled queries are
+logged to the `nbank_registry.guards` logger with the filter names (but not
+the values) so that administrators can see which query shapes cause trouble.
+
+"""
+
+import contextlib
+import json
+import logging
+
+from django.conf import settings
+from django.db import OperationalError, connections, router, transaction
+
+from nbank_registry import errors
+from nbank_registry.models import Resource
+
+logger = logging.getLogger(__name__)
+
+statement_timeout = getattr(settings, "NEUROBANK_STATEMENT_TIMEOUT", None)
+max_query_cost = getattr(settings, "NEUROBANK_MAX_QUERY_COST", None)
+
+# SQLSTATE for a statement canceled by statement_timeout
+QUERY_CANCELED = "57014"
+
+
+def permission_level(user):
+    if user is None or not user.is_authenticated:
+        return "anonymous"
+    if user.is_staff or user.is_superuser:
+        return "staff"
+    return "authenticated"
+
+
+def limit_for(setting, user):
+    """Returns the limit in setting that applies to user, or None"""
+    if isinstance(setting, dict):
+        setting = setting.get(permission_level(user))
+    return setting or None
+
+
+def query_shape(request):
+    """Describes the filters in a request without their values"""
+    keys = set(request.query_params)
+    if isinstance(request.data, dict):
+        keys.update(request.data)
+    return "{} {} [{}]".format(request.method, request.path, ", ".join(sorted(keys)))
+
+
+def is_query_canceled(err):
+    cause = err.__cause__
+    code = getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)
+    return code == QUERY_CANCELED
+
+
+def set_statement_timeout(request, using):
+    """Sets the client's statement timeout for the current transaction.
+
+    Has no effect outside a transaction.
+
+    """
+    timeout = limit_for(statement_timeout, request.user)
+    if timeout is not None:
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                "SELECT set_config('statement_timeout', %s, true)", [str(int(timeout))]
+            )
+
+
+@contextlib.contextmanager
+def timeout_guard(request, using=None):
+    """Runs the enclosed queries with the client's statement timeout.
+
+    The queries are run in a transaction on the database that resource reads
+    are routed to. Raises QueryTimeoutError if a statement is canceled.
+
+    """
+    if limit_for(statement_timeout, request.user) is None:
+        yield
+        return
+    using = using or router.db_for_read(Resource)
+    try:
+        with transaction.atomic(using=using):
+            set_statement_timeout(request, using)
+            yield
+    except OperationalError as err:
+        if not is_query_canceled(err):
+            raise
+        logger.warning("statement timeout: %s", query_shape(request))
+        raise errors.QueryTimeoutError() from err
+
+
+def guarded_stream(request, chunks):
+    """Generates chunks with the client's statement timeout.
+
+    The first chunk is generated immediately, so that a timeout in the
+    initial query is raised in the view (and returned as a 503 response)
+    rather than after the response headers have been sent.
+
+    """
+
+    def guarded():
+        with timeout_guard(request):
+            yield from chunks
+
+    def primed(first):
+        # closing this generator closes the transaction in `guarded`
+        try:
+            yield first
+            yield from inner
+        finally:
+            inner.close()
+
+    inner = guarded()
+    try:
+        return primed(next(inner))
+    except StopIteration:
+        return iter(())
+
+
+def check_query_cost(request, queryset):
+    """Raises QueryTooExpensiveError if the planner's estimate is over the limit"""
+    limit = limit_for(max_query_cost, request.user)
+    if limit is None:
+        return
+    plan = json.loads(queryset.explain(format="json"))
+    cost = plan[0]["Plan"]["Total Cost"]
+    if cost > limit:
+        logger.warning(
+            "query rejected (cost %.0f > %.0f): %s", cost, limit, query_shape(request)
+        )
+        raise errors.QueryTooExpensiveError()
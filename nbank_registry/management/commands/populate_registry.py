@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Populate the registry with synthetic records for scale testing.
+
+Records are inserted with bulk_create in batches, bypassing the API and the
+per-object save() path, so that registries with millions of resources can be
+generated in minutes. Because the signals that maintain the registry statistics
+and the resources' download fields are bypassed, the download fields are
+computed after each batch and the statistics are rebuilt at the end. The random
+number generator is seeded, so the same arguments always produce the same
+records. Records that already exist (e.g. from an earlier run with the same
+seed) are skipped, and the reported counts only include new records.
+
+"""
+
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from nbank_registry import resource_download, stats
+from nbank_registry.models import Archive, DataType, Location, Resource
+from nbank_registry.tools import base36
+
+EXPERIMENTERS = ("dmeliza", "mcb2x", "jt7dz", "ks8xf", "bsm9c", "ar4qn")
+BRAIN_REGIONS = ("HVC", "RA", "NCM", "CM", "L1", "L2a", "L3", "Ov")
+STIMULUS_SETS = ("songs-v1", "songs-v2", "noise", "ripples", "syllables")
+CONTENT_TYPES = (
+    ("wav", "audio/wav"),
+    ("pprox", "application/vnd.meliza-org.pprox+json; version=1.0"),
+    ("arf", "application/vnd.meliza-org.arf"),
+    ("", ""),
+)
+SCHEMES = ("neurobank", "neurobank", "http", "tape")
+
+
+class Command(BaseCommand):
+    help = (
+        "Populate the registry with synthetic resources, dtypes, archives and locations"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("resources", type=int, help="number of resources to create")
+        parser.add_argument(
+            "--dtypes", type=int, default=10, help="number of datatypes (default 10)"
+        )
+        parser.add_argument(
+            "--archives", type=int, default=4, help="number of archives (default 4)"
+        )
+        parser.add_argument(
+            "--users", type=int, default=5, help="number of creators (default 5)"
+        )
+        parser.add_argument(
+            "--max-locations",
+            type=int,
+            default=2,
+            help="maximum number of locations per resource (default 2)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="number of resources inserted per batch (default 10000)",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=1, help="random seed (default 1)"
+        )
+        parser.add_argument(
+            "--prefix",
+            default="synthetic",
+            help="prefix for the names of generated dtypes, archives and users",
+        )
+
+    def handle(self, *args, **options):
+        if options["resources"] < 0:
+            raise CommandError("number of resources must be non-negative")
+        if min(options["dtypes"], options["archives"], options["users"]) < 1:
+            raise CommandError("need at least one dtype, archive, and user")
+        if options["batch_size"] < 1:
+            raise CommandError("batch size must be positive")
+        if options["max_locations"] < 1:
+            raise CommandError("need at least one location per resource")
+        rng = random.Random(options["seed"])
+        prefix = options["prefix"]
+        dtypes = self.make_dtypes(rng, prefix, options["dtypes"])
+        archives = self.make_archives(rng, prefix, options["archives"])
+        users = self.make_users(prefix, options["users"])
+
+        existing = Resource.objects.count()
+        created = 0
+        n_resources = options["resources"]
+        seen = set()
+        while created < n_resources:
+            size = min(options["batch_size"], n_resources - created)
+            with transaction.atomic():
+                resources = self.make_resources(rng, seen, size, dtypes, users)
+                self.make_locations(rng, resources, archives, options["max_locations"])
+                resource_download.update_download_fields(
+                    Resource.objects.filter(pk__in=[r.pk for r in resources]),
+                    dtypes=dtypes,
+                )
+            created += size
+            self.stdout.write(f"generated {created}/{n_resources} resources")
+        stats.rebuild()
+        # with ignore_conflicts, bulk_create doesn't say how many rows it inserted
+        inserted = Resource.objects.count() - existing
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"populated registry with {inserted} new resources "
+                f"({created - inserted} already existed)"
+            )
+        )
+
+    def make_dtypes(self, rng, prefix, count):
+        objs = []
+        for i in range(count):
+            extension, content_type = rng.choice(CONTENT_TYPES)
+            objs.append(
+                DataType(
+                    name=f"{prefix}-dtype-{i}",
+                    content_type=content_type,
+                    extension=extension,
+                    downloadable=bool(extension) and rng.random() < 0.5,
+                )
+            )
+        DataType.objects.bulk_create(objs, ignore_conflicts=True)
+        return list(
+            DataType.objects.filter(name__in=[o.name for o in objs]).order_by("name")
+        )
+
+    def make_archives(self, rng, prefix, count):
+        objs = []
+        for i in range(count):
+            scheme = SCHEMES[i % len(SCHEMES)]
+            accessibility = {
+                "neurobank": Archive.Accessibility.LOCAL,
+                "http": Archive.Accessibility.REMOTE,
+                "tape": Archive.Accessibility.OFFLINE,
+            }[scheme]
+            objs.append(
+                Archive(
+                    name=f"{prefix}-archive-{i}",
+                    scheme=scheme,
+                    root=f"/home/data/{prefix}-{i}",
+                    accessibility=accessibility,
+                )
+            )
+        Archive.objects.bulk_create(objs, ignore_conflicts=True)
+        return list(
+            Archive.objects.filter(name__in=[o.name for o in objs]).order_by("name")
+        )
+
+    def make_users(self, prefix, count):
+        objs = []
+        for i in range(count):
+            user = User(username=f"{prefix}-user-{i}")
+            user.set_unusable_password()
+            objs.append(user)
+        User.objects.bulk_create(objs, ignore_conflicts=True)
+        return list(
+            User.objects.filter(username__in=[o.username for o in objs]).order_by(
+                "username"
+            )
+        )
+
+    def make_resources(self, rng, seen, count, dtypes, users):
+        objs = []
+        while len(objs) < count:
+            name = base36.hash(rng.randint(0, base36.maximum)).lower()
+            if name in seen:
+                continue
+            seen.add(name)
+            is_source = rng.random() < 0.2
+            objs.append(
+                Resource(
+                    name=name,
+                    sha1=f"{rng.getrandbits(160):040x}" if is_source else None,
+                    dtype=rng.choice(dtypes),
+                    created_by=rng.choice(users),
+                    metadata=self.make_metadata(rng),
+                )
+            )
+        Resource.objects.bulk_create(objs, ignore_conflicts=True)
+        # ignore_conflicts means primary keys are not returned. The resources
+        # are returned in the order they were generated so that the locations
+        # are too.
+        ids = dict(
+            Resource.objects.filter(name__in=[obj.name for obj in objs]).values_list(
+                "name", "id"
+            )
+        )
+        return [Resource(id=ids[obj.name], name=obj.name) for obj in objs]
+
+    def make_locations(self, rng, resources, archives, max_locations):
+        objs = []
+        for resource in resources:
+            n = rng.randint(1, min(max_locations, len(archives)))
+            for archive in rng.sample(archives, n):
+                objs.append(Location(resource=resource, archive=archive))
+        Location.objects.bulk_create(objs, ignore_conflicts=True)
+
+    def make_metadata(self, rng):
+        metadata = {
+            "experimenter": rng.choice(EXPERIMENTERS),
+            "bird": f"C{rng.randint(1, 400)}",
+            "rec_date": f"20{rng.randint(10, 25):02}-{rng.randint(1, 12):02}-{rng.randint(1, 28):02}",
+        }
+        if rng.random() < 0.7:
+            metadata.update(
+                unit=f"{metadata['bird']}_{rng.randint(1, 12)}_{rng.randint(1, 40)}",
+                area=rng.choice(BRAIN_REGIONS),
+                depth=round(rng.uniform(100, 3000), 1),
+            )
+        if rng.random() < 0.5:
+            metadata["stimulus_set"] = rng.choice(STIMULUS_SETS)
+        if rng.random() < 0.1:
+            metadata["comment"] = "good isolation" if rng.random() < 0.5 else "noisy"
+        return metadata
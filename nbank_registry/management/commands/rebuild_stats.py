@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Recompute the registry statistics from the resource and location tables.
+
+The counts are normally maintained incrementally. Run this command after
+loading records in a way that bypasses the model signals (e.g. raw SQL or
+bulk_create), or if the counts are suspected to have drifted.
+
+"""
+
+from django.core.management.base import BaseCommand
+
+from nbank_registry import stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the registry statistics from scratch"
+
+    def handle(self, *args, **options):
+        counts = stats.rebuild()
+        total = counts[(stats.Kind.TOTAL, "")]
+        self.stdout.write(
+            self.style.SUCCESS(f"rebuilt statistics for {total} resources")
+        )
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Create and drop the partial expression indexes for indexed metadata keys.
+
+Each MetadataIndex gets an index on (metadata -> 'key') covering only the
+resources of its datatype. Indexes are built with CREATE INDEX CONCURRENTLY
+so that the resource table stays writable, which can take a while on a large
+registry. Indexes whose MetadataIndex has been deleted are dropped.
+
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connections, router
+
+from nbank_registry.models import MetadataIndex, Resource
+
+
+class Command(BaseCommand):
+    help = "Create and drop indexes to match the configured metadata indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="show what would be created and dropped without changing anything",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Resource)]
+        wanted = {
+            obj.index_name: obj for obj in MetadataIndex.objects.select_related("dtype")
+        }
+        table = Resource._meta.db_table
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+            # a failed concurrent build leaves an invalid index behind
+            cursor.execute(
+                "SELECT c.relname FROM pg_index i "
+                "JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE i.indrelid = %s::regclass AND NOT i.indisvalid",
+                [connection.ops.quote_name(table)],
+            )
+            invalid = {row[0] for row in cursor.fetchall()}
+        existing = {
+            name for name in constraints if name.startswith(MetadataIndex.INDEX_PREFIX)
+        }
+        to_drop = sorted((existing - set(wanted)) | (existing & invalid))
+        to_create = sorted(set(wanted) - (existing - invalid))
+        if not to_create and not to_drop:
+            self.stdout.write("metadata indexes are up to date")
+            return
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for name in to_drop:
+                self.stdout.write(f"dropping index {name}")
+                if not options["dry_run"]:
+                    schema_editor.execute(
+                        "DROP INDEX CONCURRENTLY IF EXISTS {}".format(
+                            schema_editor.quote_name(name)
+                        )
+                    )
+            for name in to_create:
+                self.stdout.write(f"creating index {name} on {wanted[name]}")
+                if not options["dry_run"]:
+                    schema_editor.add_index(
+                        Resource, wanted[name].index(), concurrently=True
+                    )
+        if not options["dry_run"]:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"created {len(to_create)} and dropped {len(to_drop)} indexes"
+                )
+            )
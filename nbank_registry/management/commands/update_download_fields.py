@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Recompute the stored filename and download eligibility of resources.
+
+These fields are normally kept up to date by the model signals. Run this
+command after loading records in a way that bypasses the signals (e.g. raw SQL
+or bulk_create). Resources are updated in batches of consecutive ids so that
+each transaction stays short on a large registry.
+
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from nbank_registry import resource_download
+from nbank_registry.models import DataType, Resource
+
+
+class Command(BaseCommand):
+    help = "Recompute the filename and downloadable fields of all resources"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=10000,
+            help="number of resource ids to update in each batch (default 10000)",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if batch_size < 1:
+            raise CommandError("batch size must be positive")
+        bounds = Resource.objects.aggregate(lo=Min("id"), hi=Max("id"))
+        dtypes = list(DataType.objects.all())
+        updated = 0
+        if bounds["lo"] is not None:
+            for start in range(bounds["lo"], bounds["hi"] + 1, batch_size):
+                updated += resource_download.update_download_fields(
+                    Resource.objects.filter(id__gte=start, id__lt=start + batch_size),
+                    dtypes=dtypes,
+                )
+        self.stdout.write(self.style.SUCCESS(f"updated {updated} resources"))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Middleware that decides which requests can read from the replica.
+
+See nbank_registry.routers. If NEUROBANK_REPLICA_STICKY_SECONDS is set, a
+client that writes anything is served from the default database for that many
+seconds afterwards, so that it sees its own writes even if the replica is
+lagging. Clients are identified by address.
+
+"""
+
+from django.conf import settings
+
+from nbank_registry import caching, routers
+
+sticky_seconds = getattr(settings, "NEUROBANK_REPLICA_STICKY_SECONDS", 0)
+
+
+def sticky_key(request):
+    return "nbank_registry:replica-sticky:{}".format(request.META.get("REMOTE_ADDR"))
+
+
+def _with_state(chunks, state):
+    # streamed content is generated after the middleware returns
+    token = routers.set_state(state)
+    try:
+        yield from chunks
+    finally:
+        routers.reset_state(token)
+
+
+class ReplicaMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        state = routers.RoutingState()
+        token = routers.set_state(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.reset_state(token)
+        if state.wrote and sticky_seconds:
+            caching.get_cache().set(sticky_key(request), True, sticky_seconds)
+        if response.streaming and state.use_replica:
+            response.streaming_content = _with_state(response.streaming_content, state)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = routers.get_state()
+        if (
+            state is not None
+            and routers.replica_alias
+            and routers.replica_view(request)
+            and not (sticky_seconds and caching.get_cache().get(sticky_key(request)))
+        ):
+            state.use_replica = True
+        return None
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:12
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def copy_created_on(apps, schema_editor):
+    Resource = apps.get_model("nbank_registry", "Resource")
+    Resource.objects.update(modified_on=models.F("created_on"))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0009_archive_accessibility"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="modified_on",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                help_text="updated whenever the resource or its locations change",
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(copy_created_on, migrations.RunPython.noop),
+    ]
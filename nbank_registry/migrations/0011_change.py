@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0010_resource_modified_on"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Change",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("timestamp", models.DateTimeField(auto_now_add=True)),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("resource-created", "resource created"),
+                            ("resource-updated", "resource updated"),
+                            ("resource-deleted", "resource deleted"),
+                            ("location-added", "location added"),
+                            ("location-removed", "location removed"),
+                        ],
+                        max_length=32,
+                    ),
+                ),
+                ("resource_name", models.CharField(max_length=255)),
+                ("archive_name", models.CharField(blank=True, max_length=32)),
+            ],
+            options={
+                "ordering": ["id"],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:05
+
+from django.db import migrations, models
+from django.db.models.functions import TruncMonth
+
+
+def count_resources(apps, schema_editor):
+    Resource = apps.get_model("nbank_registry", "Resource")
+    Location = apps.get_model("nbank_registry", "Location")
+    Statistic = apps.get_model("nbank_registry", "Statistic")
+    resources = Resource.objects.order_by()
+    rows = [Statistic(kind="total", key="", count=resources.count())]
+    for kind, field, qs in (
+        ("dtype", "dtype_id", resources),
+        ("creator", "created_by_id", resources),
+        ("archive", "archive_id", Location.objects.order_by()),
+    ):
+        for key, count in qs.values_list(field).annotate(n=models.Count("id")):
+            rows.append(Statistic(kind=kind, key=str(key), count=count))
+    months = resources.annotate(month=TruncMonth("created_on")).values_list("month")
+    for month, count in months.annotate(n=models.Count("id")):
+        rows.append(Statistic(kind="month", key=month.strftime("%Y-%m"), count=count))
+    Statistic.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0011_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Statistic",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("total", "total resources"),
+                            ("dtype", "resources by dtype"),
+                            ("archive", "locations by archive"),
+                            ("creator", "resources by creator"),
+                            ("month", "resources by month created"),
+                        ],
+                        max_length=16,
+                    ),
+                ),
+                ("key", models.CharField(blank=True, max_length=32)),
+                ("count", models.BigIntegerField(default=0)),
+            ],
+            options={
+                "ordering": ["kind", "key"],
+                "unique_together": {("kind", "key")},
+            },
+        ),
+        migrations.RunPython(count_resources, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:20
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+import nbank_registry.search
+
+CREATE_FUNCTION = """
+CREATE FUNCTION nbank_registry_resource_search_vector(name text, metadata jsonb)
+RETURNS tsvector LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+  SELECT setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+         setweight(jsonb_to_tsvector('simple', coalesce(metadata, '{}'::jsonb),
+                                     '["string", "numeric", "boolean"]'), 'B')
+$$;
+"""
+
+DROP_FUNCTION = """
+DROP FUNCTION nbank_registry_resource_search_vector(text, jsonb);
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0012_statistic"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_FUNCTION, DROP_FUNCTION),
+        migrations.AddIndex(
+            model_name="resource",
+            index=django.contrib.postgres.indexes.GinIndex(
+                nbank_registry.search.ResourceSearchVector(),
+                name="resource_search_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 16:02
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0013_resource_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetadataIndex",
+            fields=[
+                ("id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "key",
+                    models.CharField(
+                        help_text="top-level metadata key to index",
+                        max_length=40,
+                        validators=[
+                            django.core.validators.RegexValidator(
+                                "^[A-Za-z0-9_-]+$",
+                                "only letters, numbers, underscores and hyphens are allowed",
+                            )
+                        ],
+                    ),
+                ),
+                (
+                    "dtype",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="metadata_indexes",
+                        to="nbank_registry.datatype",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name_plural": "metadata indexes",
+                "ordering": ["dtype", "key"],
+                "unique_together": {("dtype", "key")},
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.18 on 2026-10-19 18:20
+
+from django.db import migrations, models
+from django.db.models.functions import Concat
+
+
+def fill_download_fields(apps, schema_editor):
+    Resource = apps.get_model("nbank_registry", "Resource")
+    DataType = apps.get_model("nbank_registry", "DataType")
+    Location = apps.get_model("nbank_registry", "Location")
+    local = Location.objects.filter(
+        resource_id=models.OuterRef("pk"), archive__scheme="neurobank"
+    )
+    for dtype in DataType.objects.all():
+        ext = dtype.extension.lstrip(".")
+        if ext:
+            filename = models.Case(
+                models.When(name__regex=r"^.+\.[^.]+$", then=models.F("name")),
+                default=Concat(models.F("name"), models.Value(f".{ext}")),
+                output_field=models.CharField(),
+            )
+        else:
+            filename = models.F("name")
+        downloadable = models.Exists(local) if dtype.downloadable else False
+        Resource.objects.filter(dtype=dtype).update(
+            filename=filename, downloadable=downloadable
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0014_metadataindex"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="resource",
+            name="filename",
+            field=models.CharField(
+                blank=True,
+                default="",
+                editable=False,
+                help_text="the name with the dtype's extension, for clients to use in naming downloaded files",
+                max_length=264,
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="resource",
+            name="downloadable",
+            field=models.BooleanField(
+                default=False,
+                editable=False,
+                help_text="the dtype is downloadable and the resource is in a neurobank archive",
+            ),
+        ),
+        migrations.RunPython(fill_download_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 20:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("nbank_registry", "0015_resource_download_fields"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archive",
+            name="modified_on",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                help_text="updated whenever the archive changes",
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="datatype",
+            name="modified_on",
+            field=models.DateTimeField(
+                auto_now=True,
+                default=django.utils.timezone.now,
+                help_text="updated whenever the datatype changes",
+            ),
+            preserve_default=False,
+        ),
+    ]
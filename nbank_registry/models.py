@@ -1,10 +1,14 @@
 # -*- mode: python -*-
 
-from pathlib import Path
 
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.core.validators import RegexValidator
+from django.db import connections, models, router, transaction
+from django.db.models.fields.json import KeyTransform
+from django.db.models.functions import Now
 from django.utils.translation import gettext_lazy as _
 
+from nbank_registry.search import ResourceSearchVector
 from nbank_registry.tools import random_id
 
 
@@ -26,21 +30,30 @@ class Resource(models.Model):
     created_by = models.ForeignKey(
         "auth.User", related_name="resources", on_delete=models.CASCADE
     )
+    modified_on = models.DateTimeField(
+        auto_now=True,
+        help_text="updated whenever the resource or its locations change",
+    )
     metadata = models.JSONField(blank=True, null=True)
+    # derived from name, dtype and locations (see nbank_registry.signals)
+    filename = models.CharField(
+        max_length=264,
+        blank=True,
+        editable=False,
+        help_text="the name with the dtype's extension, for clients to use in naming downloaded files",
+    )
+    downloadable = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="the dtype is downloadable and the resource is in a neurobank archive",
+    )
 
     def __str__(self):
         return str(self.name)
 
-    def filename(self):
-        name = Path(self.name)
-        if not name.suffix and self.dtype.extension:
-            ext = self.dtype.extension.lstrip(".")
-            return str(name.with_suffix(f".{ext}"))
-        else:
-            return self.name
-
     class Meta:
         ordering = ["-id"]
+        indexes = [GinIndex(ResourceSearchVector(), name="resource_search_idx")]
 
 
 class DataType(models.Model):
@@ -55,6 +68,10 @@ class DataType(models.Model):
         blank=True,
         help_text="default file extension for this data type for clients to use in naming downloaded resources",
     )
+    modified_on = models.DateTimeField(
+        auto_now=True,
+        help_text="updated whenever the datatype changes",
+    )
 
     def __str__(self):
         return self.name
@@ -63,6 +80,55 @@ class DataType(models.Model):
         ordering = ["name"]
 
 
+class MetadataIndex(models.Model):
+    """A metadata key that is indexed for resources of one datatype.
+
+    The indexes themselves are created and dropped by the
+    sync_metadata_indexes management command. Each index is on the jsonb value
+    of the key (`metadata -> 'key'`), which is the expression that metadata
+    filters already compare, so indexing a key doesn't change what the filters
+    return.
+
+    """
+
+    INDEX_PREFIX = "nbank_md_"
+
+    id = models.AutoField(primary_key=True)
+    dtype = models.ForeignKey(
+        "DataType", related_name="metadata_indexes", on_delete=models.CASCADE
+    )
+    key = models.CharField(
+        max_length=40,
+        validators=[
+            RegexValidator(
+                r"^[A-Za-z0-9_-]+$",
+                "only letters, numbers, underscores and hyphens are allowed",
+            )
+        ],
+        help_text="top-level metadata key to index",
+    )
+
+    def __str__(self):
+        return f"{self.dtype}:{self.key}"
+
+    @property
+    def index_name(self):
+        return f"{self.INDEX_PREFIX}{self.dtype_id}_{self.key}"
+
+    def index(self):
+        """Returns the partial expression index for this key"""
+        return models.Index(
+            KeyTransform(self.key, "metadata"),
+            name=self.index_name,
+            condition=models.Q(dtype_id=self.dtype_id),
+        )
+
+    class Meta:
+        unique_together = ("dtype", "key")
+        ordering = ["dtype", "key"]
+        verbose_name_plural = "metadata indexes"
+
+
 class Archive(models.Model):
     """An archive defines a method and authority for locating a resource"""
 
@@ -78,6 +144,10 @@ class Archive(models.Model):
     accessibility = models.IntegerField(
         choices=Accessibility.choices, default=Accessibility.LOCAL
     )
+    modified_on = models.DateTimeField(
+        auto_now=True,
+        help_text="updated whenever the archive changes",
+    )
 
     def __str__(self):
         return self.name
@@ -100,3 +170,125 @@ class Location(models.Model):
     class Meta:
         unique_together = ("resource", "archive")
         ordering = ["-id"]
+
+
+class Change(models.Model):
+    """An entry in the append-only log of changes to resources and their locations.
+
+    The id is a monotonically increasing sequence number that clients can use to
+    retrieve only the changes since their last update. Sequence numbers are
+    drawn when rows are inserted, not when they are committed, so writers take
+    an advisory lock (see `lock_log`) that makes the log commit in sequence
+    order. Otherwise a client could read change n + 1 before change n commits
+    and then never see n.
+
+    """
+
+    # key for the transaction-level advisory lock that serializes writers
+    LOG_LOCK = 0x6E62616E6B
+
+    class Action(models.TextChoices):
+        RESOURCE_CREATED = "resource-created", _("resource created")
+        RESOURCE_UPDATED = "resource-updated", _("resource updated")
+        RESOURCE_DELETED = "resource-deleted", _("resource deleted")
+        LOCATION_ADDED = "location-added", _("location added")
+        LOCATION_REMOVED = "location-removed", _("location removed")
+
+    id = models.BigAutoField(primary_key=True)
+    timestamp = models.DateTimeField(auto_now_add=True)
+    action = models.CharField(max_length=32, choices=Action.choices)
+    # names rather than foreign keys so that the log outlives deleted records
+    resource_name = models.CharField(max_length=255)
+    archive_name = models.CharField(max_length=32, blank=True)
+
+    def __str__(self):
+        return f"{self.id}: {self.action} {self.resource_name}"
+
+    @classmethod
+    def lock_log(cls):
+        """Blocks other writers of the log until the current transaction ends.
+
+        Must be called in a transaction before inserting into the log. Write
+        paths that record changes should call it before writing anything else,
+        so that every writer takes the log lock before any row locks (including
+        the shared Statistic rows updated by signals) and writers can't
+        deadlock.
+
+        """
+        with connections[router.db_for_write(cls)].cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", [cls.LOG_LOCK])
+
+    @classmethod
+    def record(cls, action, resource, archive=None):
+        with transaction.atomic(using=router.db_for_write(cls)):
+            cls.lock_log()
+            return cls.objects.create(
+                action=action,
+                resource_name=str(resource),
+                archive_name=str(archive) if archive is not None else "",
+            )
+
+    @classmethod
+    def record_all(cls, action, resources):
+        """Records the same action for every resource in a queryset.
+
+        The changes are added in name order with a single INSERT ... SELECT, so
+        the resources are never loaded into Python. Returns the number of
+        changes recorded.
+
+        """
+        using = router.db_for_write(cls)
+        connection = connections[using]
+        select = (
+            resources.order_by("name")
+            .annotate(
+                change_timestamp=Now(),
+                change_action=models.Value(action),
+                change_archive=models.Value(""),
+            )
+            .values_list("change_timestamp", "change_action", "name", "change_archive")
+        )
+        sql, params = select.query.get_compiler(using=using).as_sql()
+        columns = ", ".join(
+            connection.ops.quote_name(cls._meta.get_field(field).column)
+            for field in ("timestamp", "action", "resource_name", "archive_name")
+        )
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with transaction.atomic(using=using):
+            cls.lock_log()
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {table} ({columns}) {sql}", params)
+                return cursor.rowcount
+
+    class Meta:
+        ordering = ["id"]
+
+
+class Statistic(models.Model):
+    """A running count of resources (or locations) in one group.
+
+    Counts are kept up to date incrementally by nbank_registry.signals and can
+    be rebuilt from the tables with the rebuild_stats management command. For
+    dtype, archive, and creator counts, the key is the primary key of the
+    group; for month counts, it is YYYY-MM; for the total, it is empty.
+
+    """
+
+    class Kind(models.TextChoices):
+        TOTAL = "total", _("total resources")
+        DTYPE = "dtype", _("resources by dtype")
+        ARCHIVE = "archive", _("locations by archive")
+        CREATOR = "creator", _("resources by creator")
+        MONTH = "month", _("resources by month created")
+
+    id = models.AutoField(primary_key=True)
+    kind = models.CharField(max_length=16, choices=Kind.choices)
+    key = models.CharField(max_length=32, blank=True)
+    count = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.kind}:{self.key} = {self.count}"
+
+    class Meta:
+        unique_together = ("kind", "key")
+        ordering = ["kind", "key"]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Parsers for streamed request bodies.
+
+The bulk endpoints accept a list of names as a JSON object, which DRF has to
+read and parse completely before the view can start. They also accept
+`application/x-ndjson` bodies with one name (a JSON string) per line.
+NDJSONNameParser doesn't read anything itself; it returns a NameStream that
+reads the body a chunk of names at a time as the response is generated, so
+the first records can be sent before the whole body has arrived.
+
+"""
+
+import itertools
+import json
+
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+from rest_framework.settings import api_settings
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class NameStream:
+    """Lazily reads names, one JSON string per line, from a request body.
+
+    Blank lines are skipped. Raises ParseError when a line is not a JSON string.
+    Can only be iterated once.
+
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def __iter__(self):
+        for lineno, line in enumerate(self.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                name = json.loads(line)
+            except ValueError as err:
+                raise ParseError(f"line {lineno}: not valid JSON") from err
+            if not isinstance(name, str):
+                raise ParseError(f"line {lineno}: expected a name (JSON string)")
+            yield name
+
+    def chunks(self, size):
+        """Yields lists of up to size names"""
+        names = iter(self)
+        while chunk := list(itertools.islice(names, size)):
+            yield chunk
+
+
+class NDJSONNameParser(parsers.BaseParser):
+    media_type = NDJSON_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return NameStream(stream)
+
+
+BULK_PARSER_CLASSES = (*api_settings.DEFAULT_PARSER_CLASSES, NDJSONNameParser)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Renderers for JSON, streaming, and binary responses.
+
+FastJSONRenderer is a drop-in replacement for the DRF JSONRenderer that uses
+orjson if it's installed. The views in this app use it in place of JSONRenderer
+in DEFAULT_RENDERER_CLASSES; sites can also list it in their REST_FRAMEWORK
+settings.
+
+The bulk endpoints render each record separately. JSONLRenderer produces
+line-delimited JSON. If the msgpack package is installed, clients can request
+`application/x-msgpack` instead; streamed records are then framed with a 4-byte
+big-endian length prefix.
+
+"""
+
+import struct
+
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """Renders compact JSON using orjson, falling back to the stdlib encoder.
+
+    The output is the same as JSONRenderer's compact output. Datetimes and any
+    other types orjson doesn't handle the same way are passed to the DRF
+    encoder. Indented output (requested with `; indent=n` in the Accept header)
+    is always rendered by the stdlib encoder.
+
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if indent:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # escape line separators the same way JSONRenderer does
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+                b"\xe2\x80\xa9", b"\\u2029"
+            )
+        return ret
+
+
+class JSONLRenderer(FastJSONRenderer):
+    media_type = "application/x-ndjson"
+    format = "jsonl"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        out = super().render(data, accepted_media_type=None, renderer_context=None)
+        return out + b"\n"
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """Renders data as a single MessagePack document. Requires msgpack."""
+
+    media_type = MSGPACK_MEDIA_TYPE
+    format = "msgpack"
+    charset = None
+    render_style = "binary"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        return msgpack.packb(data, default=encoders.JSONEncoder().default)
+
+
+class MessagePackStreamRenderer(MessagePackRenderer):
+    """Renders a record as a length-prefixed MessagePack frame for streaming"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        out = super().render(data, accepted_media_type, renderer_context)
+        return struct.pack(">I", len(out)) + out
+
+
+def with_msgpack(renderer_classes, msgpack_renderer=MessagePackRenderer):
+    """Appends a MessagePack renderer to renderer_classes if msgpack is installed"""
+    if msgpack is None:
+        return tuple(renderer_classes)
+    return (*renderer_classes, msgpack_renderer)
+
+
+# the site's default renderers, with FastJSONRenderer in place of JSONRenderer
+DEFAULT_RENDERER_CLASSES = tuple(
+    FastJSONRenderer if cls is renderers.JSONRenderer else cls
+    for cls in api_settings.DEFAULT_RENDERER_CLASSES
+)
+
+# renderers for views that stream records. The default renderers are included
+# so that errors and the browsable API are rendered as usual.
+STREAM_RENDERER_CLASSES = with_msgpack(
+    DEFAULT_RENDERER_CLASSES, MessagePackStreamRenderer
+)
+
+
+def record_renderer(request):
+    """Returns the renderer to use for each record in a streaming response"""
+    if isinstance(getattr(request, "accepted_renderer", None), MessagePackRenderer):
+        return request.accepted_renderer
+    return JSONLRenderer()
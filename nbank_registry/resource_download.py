@@ -4,41 +4,315 @@
 
 A resource is downloadable if the dtype is marked as downloadable and if it has
 a location that resolves to a local path on the server. The code to resolve this
-local path has been vendored from the neurobank package.
+local path has been vendored from the neurobank package. Whether a resource has
+a downloadable dtype and a location in a neurobank archive is stored in
+Resource.downloadable, along with its filename, so that listings don't need to
+look up the dtype or locations. The signal handlers in nbank_registry.signals
+keep these fields up to date; code that bypasses the signals must call
+update_download_fields().
+
+Archives are usually network mounts, and a hung mount blocks any process that
+touches it. Archives are therefore probed in worker threads with a timeout
+(NEUROBANK_ARCHIVE_PROBE_TIMEOUT seconds). Each archive has its own small pool
+of workers, so probes stuck on one archive can't hold up probes of the others.
+After NEUROBANK_ARCHIVE_MAX_FAILURES consecutive failed probes, an archive is
+skipped for NEUROBANK_ARCHIVE_RETRY_SECONDS before it is probed again. A probe
+that times out while waiting for a worker is only counted as a failure if every
+worker has been stuck on one probe for longer than the timeout, so that a hung
+archive is still skipped once all of its workers are stuck, but a busy one is
+not. The health of each archive is kept in NEUROBANK_CACHE.
 
 """
 
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as ProbeTimeoutError
 from pathlib import Path
 
-from nbank_registry import errors
+from django.conf import settings
+from django.db.models import (
+    BooleanField,
+    Case,
+    CharField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import Concat
+
+from nbank_registry import caching, errors
+from nbank_registry.models import DataType, Location, Resource
+
+logger = logging.getLogger(__name__)
+
+probe_timeout = getattr(settings, "NEUROBANK_ARCHIVE_PROBE_TIMEOUT", 5.0)
+max_failures = getattr(settings, "NEUROBANK_ARCHIVE_MAX_FAILURES", 3)
+retry_seconds = getattr(settings, "NEUROBANK_ARCHIVE_RETRY_SECONDS", 60)
+
+# probes of a hung mount never return, so this bounds the number of threads
+# that can be stuck on each archive
+PROBE_WORKERS = 2
+
+_probe_executors = {}
+# start times of running probes, by archive and worker thread
+_probe_started = {}
+_probe_executors_lock = threading.Lock()
+
+
+def probe_executor(archive) -> ThreadPoolExecutor:
+    """Returns the pool of worker threads that probe archive"""
+    with _probe_executors_lock:
+        try:
+            return _probe_executors[archive.pk]
+        except KeyError:
+            executor = _probe_executors[archive.pk] = ThreadPoolExecutor(
+                max_workers=PROBE_WORKERS,
+                thread_name_prefix=f"nbank-probe-{archive.pk}",
+            )
+            return executor
+
+
+def run_probe(resolve, location) -> Path:
+    """Calls resolve(location), keeping track of how long the worker is busy"""
+    pk = location.archive.pk
+    worker = threading.get_ident()
+    with _probe_executors_lock:
+        _probe_started.setdefault(pk, {})[worker] = time.monotonic()
+    try:
+        return resolve(location)
+    finally:
+        with _probe_executors_lock:
+            del _probe_started[pk][worker]
+
+
+def workers_stuck(archive) -> bool:
+    """True if every worker for archive has been on one probe for longer than the timeout"""
+    deadline = time.monotonic() - probe_timeout
+    with _probe_executors_lock:
+        started = list(_probe_started.get(archive.pk, {}).values())
+    return sum(t <= deadline for t in started) >= PROBE_WORKERS
+
+
+# matches names that Path considers to have a suffix
+SUFFIX_RE = r"^.+\.[^.]+$"
+
+
+def resource_filename(name: str, extension: str) -> str:
+    """Returns the filename of a resource, adding extension if name doesn't have one"""
+    ext = extension.lstrip(".")
+    path = Path(name)
+    if not path.suffix and ext:
+        return str(path.with_suffix(f".{ext}"))
+    return name
+
+
+def has_local_location(resource) -> bool:
+    return resource.location_set.filter(archive__scheme="neurobank").exists()
+
+
+def filename_expression(extension: str):
+    """The database equivalent of resource_filename for a dtype's extension"""
+    ext = extension.lstrip(".")
+    if not ext:
+        return F("name")
+    return Case(
+        When(name__regex=SUFFIX_RE, then=F("name")),
+        default=Concat(F("name"), Value(f".{ext}")),
+        output_field=CharField(),
+    )
+
+
+def downloadable_expression():
+    """True for resources of a downloadable dtype that are in a neurobank archive"""
+    return ExpressionWrapper(
+        Q(Exists(DataType.objects.filter(pk=OuterRef("dtype_id"), downloadable=True)))
+        & Q(
+            Exists(
+                Location.objects.filter(
+                    resource_id=OuterRef("pk"), archive__scheme="neurobank"
+                )
+            )
+        ),
+        output_field=BooleanField(),
+    )
+
+
+def update_download_fields(queryset, dtypes=None) -> int:
+    """Recomputes filename and downloadable for the resources in queryset.
+
+    Uses one UPDATE for each dtype in dtypes (default: all dtypes). Returns the
+    number of resources updated.
+
+    """
+    if dtypes is None:
+        dtypes = DataType.objects.all()
+    updated = 0
+    for dtype in dtypes:
+        updated += queryset.filter(dtype=dtype).update(
+            filename=filename_expression(dtype.extension),
+            downloadable=downloadable_expression(),
+        )
+    return updated
+
+
+def archive_health_key(archive) -> str:
+    return f"nbank_registry:archive-health:{archive.pk}"
+
+
+def archive_available(archive) -> bool:
+    """True if archive should be probed.
+
+    If the circuit is open (too many recent failures) but the retry period has
+    elapsed, the caller is allowed one trial probe, and other callers keep
+    skipping the archive until the trial is recorded or the period elapses
+    again.
+
+    """
+    cache = caching.get_cache()
+    key = archive_health_key(archive)
+    failures, retry_at = cache.get(key, (0, 0.0))
+    if failures < max_failures:
+        return True
+    now = time.time()
+    if now < retry_at:
+        return False
+    cache.set(key, (failures, now + retry_seconds), caching.cache_timeout)
+    return True
+
+
+def record_probe(archive, ok: bool) -> None:
+    """Updates the health of archive after a probe"""
+    cache = caching.get_cache()
+    key = archive_health_key(archive)
+    if ok:
+        cache.delete(key)
+        return
+    failures, retry_at = cache.get(key, (0, 0.0))
+    failures += 1
+    if failures >= max_failures:
+        retry_at = time.time() + retry_seconds
+        logger.warning(
+            "archive '%s' is unavailable after %d failed probes; skipping it for %d s",
+            archive,
+            failures,
+            retry_seconds,
+        )
+    cache.set(key, (failures, retry_at), caching.cache_timeout)
+
+
+def probe_location(location, files_only: bool = True) -> Path:
+    """Resolves location to a path in a worker thread, with a timeout.
+
+    Raises ArchiveUnavailableError if the archive is marked unavailable, or if
+    the filesystem doesn't respond in time or raises an OSError. If
+    `files_only` is False, the path can also be a directory.
+
+    """
+    archive = location.archive
+    if not archive_available(archive):
+        raise errors.ArchiveUnavailableError(archive)
+    resolve = location_to_path if files_only else location_path
+    future = probe_executor(archive).submit(run_probe, resolve, location)
+    try:
+        path = future.result(timeout=probe_timeout)
+    except errors.NotAvailableForDownloadError:
+        # the filesystem responded
+        record_probe(archive, True)
+        raise
+    except ProbeTimeoutError as err:
+        # cancel() only succeeds if the probe was still waiting for a worker.
+        # That's only a failure if the workers are stuck, as they are on a hung
+        # mount; otherwise the archive is just busy.
+        if not future.cancel() or workers_stuck(archive):
+            record_probe(archive, False)
+        raise errors.ArchiveUnavailableError(archive) from err
+    except OSError as err:
+        record_probe(archive, False)
+        raise errors.ArchiveUnavailableError(archive) from err
+    record_probe(archive, True)
+    return path
 
 
 def local_resource_path(resource) -> Path:
-    if not resource.dtype.downloadable:
-        raise errors.NonDownloadableDtypeError()
-    for location in resource.location_set.all():
+    """Returns the path of resource in the most accessible archive that has it.
+
+    If no archive has the resource, raises ArchiveUnavailableError if any
+    archive was unavailable (the resource may be there), and otherwise the
+    first error from an archive that did not have it.
+
+    """
+    if not resource.downloadable:
+        if not resource.dtype.downloadable:
+            raise errors.NonDownloadableDtypeError()
+        raise errors.SchemeNotImplementedError()
+    locations = resource.location_set.select_related("archive").order_by(
+        "archive__accessibility", "id"
+    )
+    failures = []
+    for location in locations:
+        if location.archive.scheme != "neurobank":
+            continue
         try:
-            return location_to_path(location)
-        except errors.SchemeNotImplementedError:
-            pass
-    raise errors.SchemeNotImplementedError()
+            return probe_location(location)
+        except errors.NotAvailableForDownloadError as err:
+            failures.append(err)
+    if not failures:
+        raise errors.SchemeNotImplementedError()
+    raise max(failures, key=lambda err: isinstance(err, errors.ArchiveUnavailableError))
 
 
-def location_to_path(location) -> Path:
+def location_path(location) -> Path:
+    """Returns the path of location, which may be a file or a directory"""
     if location.archive.scheme != "neurobank":
         raise errors.SchemeNotImplementedError()
-    id = location.resource.name
-    id_stub = id[:2]
-    partial = Path(location.archive.root) / "resources" / id_stub / id
+    partial = resource_path(location.archive.root, location.resource.name)
     try:
-        path = resolve_extension(partial)
+        return resolve_extension(partial)
     except FileNotFoundError as err:
         raise errors.MissingFileError(location.resource, partial.parent) from err
+
+
+def location_to_path(location) -> Path:
+    path = location_path(location)
     if not path.is_file():
+        partial = resource_path(location.archive.root, location.resource.name)
         raise errors.NotAFileError(location.resource, partial)
     return path
 
 
+def resource_path(root: str, id: str) -> Path:
+    """Returns the path of resource `id` (without any extension) in a neurobank archive"""
+    return Path(root) / "resources" / id[:2] / id
+
+
+def location_url(archive, id: str, probe: bool = False) -> str | None:
+    """Returns the full path or URL of a resource in an archive.
+
+    For neurobank archives, this is the local path to the resource. The
+    filesystem is only accessed if `probe` is True, in which case the path is
+    resolved by probe_location, and None is returned if the resource does not
+    exist or the archive is unavailable. For other schemes, this is a URL
+    formed by appending the id to the archive root.
+
+    """
+    if archive.scheme == "neurobank":
+        if not probe:
+            return str(resource_path(archive.root, id))
+        location = Location(archive=archive, resource=Resource(name=id))
+        try:
+            return str(probe_location(location, files_only=False))
+        except errors.NotAvailableForDownloadError:
+            return None
+    sep = "" if archive.root.endswith("/") else "/"
+    return f"{archive.scheme}://{archive.root}{sep}{id}"
+
+
 def resolve_extension(path: Path) -> Path:
     """Resolves the full path including extension of a resource.
 
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Database routing for read replicas.
+
+ReplicaRouter sends reads to the database alias named by
+NEUROBANK_REPLICA_DATABASE, but only during requests to the read-only
+endpoints listed in REPLICA_VIEWS. ReplicaMiddleware (in
+nbank_registry.middleware) decides which requests are eligible. Everything
+else, including management commands and all writes, uses the default database.
+As soon as a request writes anything, its remaining queries are pinned to the
+default database so that it can read its own writes.
+
+"""
+
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+replica_alias = getattr(settings, "NEUROBANK_REPLICA_DATABASE", None)
+
+# url names (in the neurobank namespace) of the views that can be served from
+# the replica, by request method
+REPLICA_VIEWS = {
+    "GET": {
+        "resource-list",
+        "resource",
+        "location-list",
+        "datatype-list",
+        "archive-list",
+        "stats",
+    },
+    "POST": {"bulk-resource-list", "bulk-location-list"},
+}
+REPLICA_VIEWS["HEAD"] = REPLICA_VIEWS["GET"]
+
+
+class RoutingState:
+    """Tracks how queries should be routed for the current request"""
+
+    def __init__(self, use_replica=False):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+_routing_state = ContextVar("nbank_routing_state", default=None)
+
+
+def get_state():
+    return _routing_state.get()
+
+
+def set_state(state):
+    return _routing_state.set(state)
+
+
+def reset_state(token):
+    _routing_state.reset(token)
+
+
+def replica_view(request):
+    """True if the request is for a view that can be served from the replica"""
+    match = getattr(request, "resolver_match", None)
+    if match is None or "neurobank" not in match.namespaces:
+        return False
+    return match.url_name in REPLICA_VIEWS.get(request.method, ())
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = get_state()
+        if replica_alias and state is not None and state.use_replica:
+            return replica_alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = get_state()
+        if state is not None:
+            state.use_replica = False
+            state.wrote = True
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replica has the same data as the default database
+        dbs = {DEFAULT_DB_ALIAS, replica_alias}
+        if obj1._state.db in dbs and obj2._state.db in dbs:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if replica_alias and db == replica_alias:
+            return False
+        return None
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Full-text search over resource names and metadata values.
+
+The search vector is computed by a database function,
+nbank_registry_resource_search_vector(name, metadata), which is created by
+migration 0013 and backs a GIN expression index on the resource table. Name
+tokens are weighted above metadata values. The `simple` text search
+configuration is used so that identifiers like bird and unit names are matched
+as written rather than stemmed.
+
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
+from django.db.models import F, Func
+
+SEARCH_CONFIG = "simple"
+
+
+class ResourceSearchVector(Func):
+    """The tsvector for a resource. Must match the expression in the index."""
+
+    function = "nbank_registry_resource_search_vector"
+    output_field = SearchVectorField()
+
+    def __init__(self, **extra):
+        super().__init__(F("name"), F("metadata"), **extra)
+
+
+def search_query(text):
+    return SearchQuery(text, search_type="websearch", config=SEARCH_CONFIG)
+
+
+def search_resources(queryset, text):
+    """Filter resources that match `text`, annotated with their rank.
+
+    `text` uses web search syntax: words are ANDed, "quoted phrases" must
+    match in order, `or` separates alternatives, and `-word` excludes.
+
+    """
+    query = search_query(text)
+    return (
+        queryset.alias(search=ResourceSearchVector())
+        .filter(search=query)
+        .annotate(rank=SearchRank(ResourceSearchVector(), query))
+    )
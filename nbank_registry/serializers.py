@@ -4,10 +4,15 @@ from __future__ import unicode_literals
 
 import re
 
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import smart_str
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator, UniqueValidator
 
-from nbank_registry.models import Archive, DataType, Location, Resource
+from nbank_registry import caching, resource_download, stats
+from nbank_registry.expressions import metadata_patch
+from nbank_registry.models import Archive, Change, DataType, Location, Resource
 
 sha1_re = re.compile(r"[0-9a-fA-F]{40}")
 
@@ -18,6 +23,39 @@ class SlugField(serializers.SlugField):
     }
 
 
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    """A SlugRelatedField that resolves names and primary keys using a cached index.
+
+    `index` is a callable that returns {"name": {slug: obj}, "pk": {pk: obj}}
+    (see nbank_registry.caching). Falls back to the queryset if the object is not
+    in the index.
+
+    """
+
+    def __init__(self, index, **kwargs):
+        self.index = index
+        super().__init__(**kwargs)
+
+    def use_pk_only_optimization(self):
+        return True
+
+    def to_internal_value(self, data):
+        try:
+            return self.index()["name"][data]
+        except KeyError:
+            return super().to_internal_value(data)
+        except TypeError:
+            self.fail("invalid")
+
+    def to_representation(self, obj):
+        try:
+            obj = self.index()["pk"][obj.pk]
+        except KeyError:
+            if isinstance(obj, serializers.PKOnlyObject):
+                obj = self.get_queryset().get(pk=obj.pk)
+        return smart_str(getattr(obj, self.slug_field))
+
+
 class AccessibilityField(serializers.Field):
     def to_representation(self, value):
         return Archive.Accessibility(value).label
@@ -39,7 +77,8 @@ class ResourceSerializer(serializers.ModelSerializer):
             )
         ],
     )
-    dtype = serializers.SlugRelatedField(
+    dtype = CachedSlugRelatedField(
+        index=caching.datatype_index,
         queryset=DataType.objects.all(),
         slug_field="name",
         error_messages={
@@ -47,7 +86,8 @@ class ResourceSerializer(serializers.ModelSerializer):
             "invalid": "invalid dtype name",
         },
     )
-    locations = serializers.SlugRelatedField(
+    locations = CachedSlugRelatedField(
+        index=caching.archive_index,
         queryset=Archive.objects.all(),
         required=False,
         many=True,
@@ -80,31 +120,53 @@ class ResourceSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("name cannot be updated")
         return value
 
+    @transaction.atomic
     def create(self, validated_data):
+        Change.lock_log()
         archives = validated_data.pop("locations", [])
         resource = Resource.objects.create(**validated_data)
+        Change.record(Change.Action.RESOURCE_CREATED, resource)
         for archive in archives:
             Location.objects.create(resource=resource, archive=archive)
+            Change.record(Change.Action.LOCATION_ADDED, resource, archive)
         return resource
 
+    def validate_metadata(self, value):
+        if self.instance is not None and not isinstance(value, dict):
+            raise serializers.ValidationError("metadata updates must be an object")
+        return value
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         """Update the instance with supplied data.
 
         For the metadata field, any sub-fields not in the supplied data are
-        retained. To delete a subfield, set it to None
+        retained. To delete a subfield, set it to None. The merge is done by the
+        database in a single UPDATE, so concurrent updates to other subfields are
+        not lost.
         """
+        Change.lock_log()
         archives = validated_data.pop("locations", [])
         for archive in archives:
-            if archive not in instance.locations:
+            if not instance.locations.filter(pk=archive.pk).exists():
                 Location.objects.create(resource=instance, archive=archive)
+                Change.record(Change.Action.LOCATION_ADDED, instance, archive)
+        old_dtype_id = instance.dtype_id
         instance.dtype = validated_data.get("dtype", instance.dtype)
+        if instance.dtype_id != old_dtype_id:
+            stats.add(stats.dtype_deltas(old_dtype_id, instance.dtype_id))
         instance.sha1 = validated_data.get("sha1", instance.sha1)
-        for key, value in validated_data.get("metadata", {}).items():
-            if value is not None:
-                instance.metadata[key] = value
-            else:
-                instance.metadata.pop(key, None)
-        instance.save()
+        instance.modified_on = timezone.now()
+        Resource.objects.filter(pk=instance.pk).update(
+            dtype=instance.dtype,
+            sha1=instance.sha1,
+            modified_on=instance.modified_on,
+            metadata=metadata_patch(validated_data.get("metadata", {})),
+            filename=resource_download.filename_expression(instance.dtype.extension),
+            downloadable=resource_download.downloadable_expression(),
+        )
+        instance.refresh_from_db(fields=["metadata", "filename", "downloadable"])
+        Change.record(Change.Action.RESOURCE_UPDATED, instance)
         return instance
 
     class Meta:
@@ -174,6 +236,13 @@ class LocationSerializer(serializers.ModelSerializer):
     scheme = serializers.ReadOnlyField(source="archive.scheme")
     root = serializers.ReadOnlyField(source="archive.root")
 
+    @transaction.atomic
+    def create(self, validated_data):
+        Change.lock_log()
+        location = super().create(validated_data)
+        Change.record(Change.Action.LOCATION_ADDED, location.resource, location.archive)
+        return location
+
     class Meta:
         model = Location
         fields = ("archive_name", "scheme", "root", "resource_name")
@@ -183,3 +252,16 @@ class LocationSerializer(serializers.ModelSerializer):
                 fields=("resource_name", "archive_name"),
             )
         ]
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    seq = serializers.ReadOnlyField(source="id")
+    resource = serializers.ReadOnlyField(source="resource_name")
+    archive = serializers.SerializerMethodField()
+
+    def get_archive(self, obj):
+        return obj.archive_name or None
+
+    class Meta:
+        model = Change
+        fields = ("seq", "timestamp", "action", "resource", "archive")
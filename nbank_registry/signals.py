@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Signal handlers that keep caches and derived data consistent with the tables"""
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from nbank_registry import caching, resource_download, stats
+from nbank_registry.models import Archive, DataType, Location, MetadataIndex, Resource
+
+
+@receiver(post_save, sender=DataType)
+@receiver(post_delete, sender=DataType)
+def datatype_changed(sender, **kwargs):
+    caching.invalidate_datatypes()
+
+
+@receiver(pre_save, sender=DataType)
+def datatype_saving(sender, instance, **kwargs):
+    if instance.pk is None:
+        instance._saved_download_fields = None
+    else:
+        instance._saved_download_fields = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list("extension", "downloadable")
+            .first()
+        )
+
+
+@receiver(post_save, sender=DataType)
+def datatype_saved(sender, instance, created, **kwargs):
+    saved = getattr(instance, "_saved_download_fields", None)
+    if saved is not None and saved != (instance.extension, instance.downloadable):
+        resource_download.update_download_fields(
+            Resource.objects.filter(dtype=instance), dtypes=[instance]
+        )
+
+
+@receiver(post_save, sender=Archive)
+@receiver(post_delete, sender=Archive)
+def archive_changed(sender, **kwargs):
+    caching.invalidate_archives()
+
+
+@receiver(pre_save, sender=Archive)
+def archive_saving(sender, instance, update_fields=None, **kwargs):
+    instance._saved_scheme = _saved_value(sender, instance, "scheme", update_fields)
+
+
+@receiver(post_save, sender=Archive)
+def archive_saved(sender, instance, created, **kwargs):
+    saved = getattr(instance, "_saved_scheme", None)
+    if saved is not None and saved != instance.scheme:
+        Resource.objects.filter(location__archive=instance).update(
+            downloadable=resource_download.downloadable_expression()
+        )
+
+
+@receiver(post_save, sender=MetadataIndex)
+@receiver(post_delete, sender=MetadataIndex)
+def metadata_index_changed(sender, **kwargs):
+    caching.invalidate_metadata_indexes()
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def location_changed(sender, instance, **kwargs):
+    Resource.objects.filter(pk=instance.resource_id).update(
+        modified_on=timezone.now(),
+        downloadable=resource_download.downloadable_expression(),
+    )
+
+
+def _saved_value(sender, instance, field, update_fields):
+    # the value of field in the database before instance is saved
+    if instance._state.adding or instance.pk is None:
+        return None
+    if update_fields is not None and field not in update_fields:
+        return None
+    return sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+@receiver(pre_save, sender=Resource)
+def resource_saving(sender, instance, update_fields=None, **kwargs):
+    instance._stats_dtype_id = _saved_value(sender, instance, "dtype_id", update_fields)
+    dtype = instance.dtype
+    instance.filename = resource_download.resource_filename(
+        instance.name, dtype.extension
+    )
+    instance.downloadable = (
+        dtype.downloadable
+        and not instance._state.adding
+        and resource_download.has_local_location(instance)
+    )
+
+
+@receiver(post_save, sender=Resource)
+def resource_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.add(stats.resource_deltas(instance))
+    else:
+        old_dtype_id = getattr(instance, "_stats_dtype_id", None)
+        if old_dtype_id is not None and old_dtype_id != instance.dtype_id:
+            stats.add(stats.dtype_deltas(old_dtype_id, instance.dtype_id))
+
+
+@receiver(post_delete, sender=Resource)
+def resource_deleted(sender, instance, **kwargs):
+    stats.add(stats.resource_deltas(instance, -1))
+
+
+@receiver(pre_save, sender=Location)
+def location_saving(sender, instance, update_fields=None, **kwargs):
+    instance._stats_archive_id = _saved_value(
+        sender, instance, "archive_id", update_fields
+    )
+
+
+@receiver(post_save, sender=Location)
+def location_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.add(stats.location_deltas(instance))
+    else:
+        old_archive_id = getattr(instance, "_stats_archive_id", None)
+        if old_archive_id is not None and old_archive_id != instance.archive_id:
+            deltas = stats.location_deltas(instance)
+            deltas[(stats.Kind.ARCHIVE, str(old_archive_id))] -= 1
+            stats.add(deltas)
+
+
+@receiver(post_delete, sender=Location)
+def location_deleted(sender, instance, **kwargs):
+    stats.add(stats.location_deltas(instance, -1))
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Summary counts of the resources and locations in the registry.
+
+Counting resources by dtype, creator, or month with GROUP BY queries gets slow
+as the tables grow, so the counts are kept in the Statistic table and adjusted
+whenever a resource or location is created, deleted, or changed (see
+nbank_registry.signals). Code that bypasses the signals (e.g. bulk_create)
+must call add() itself or run rebuild() afterwards.
+
+"""
+
+from collections import Counter
+
+from django.contrib.auth.models import User
+from django.db import connections, router, transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from nbank_registry import caching
+from nbank_registry.models import Location, Resource, Statistic
+
+Kind = Statistic.Kind
+
+
+def month_key(dt):
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    return dt.strftime("%Y-%m")
+
+
+def resource_deltas(resource, sign=1):
+    """Returns the changes to the counts from adding (or removing) a resource"""
+    return Counter(
+        {
+            (Kind.TOTAL, ""): sign,
+            (Kind.DTYPE, str(resource.dtype_id)): sign,
+            (Kind.CREATOR, str(resource.created_by_id)): sign,
+            (Kind.MONTH, month_key(resource.created_on)): sign,
+        }
+    )
+
+
+def location_deltas(location, sign=1):
+    """Returns the changes to the counts from adding (or removing) a location"""
+    return Counter({(Kind.ARCHIVE, str(location.archive_id)): sign})
+
+
+def dtype_deltas(old_dtype_id, new_dtype_id):
+    """Returns the changes to the counts from changing a resource's dtype"""
+    return Counter(
+        {(Kind.DTYPE, str(old_dtype_id)): -1, (Kind.DTYPE, str(new_dtype_id)): 1}
+    )
+
+
+def add(deltas):
+    """Applies deltas, a mapping from (kind, key) to change, to the counts.
+
+    Uses a single INSERT ... ON CONFLICT statement, so missing rows are created
+    and concurrent updates are not lost. Rows are locked in sorted order to
+    avoid deadlocks between concurrent transactions.
+
+    """
+    items = sorted((str(kind), key, n) for (kind, key), n in deltas.items() if n)
+    if not items:
+        return
+    connection = connections[router.db_for_write(Statistic)]
+    qn = connection.ops.quote_name
+    table = qn(Statistic._meta.db_table)
+    kind, key, count = qn("kind"), qn("key"), qn("count")
+    values = ", ".join(["(%s, %s, %s)"] * len(items))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} ({kind}, {key}, {count}) VALUES {values} "
+            f"ON CONFLICT ({kind}, {key}) "
+            f"DO UPDATE SET {count} = {table}.{count} + EXCLUDED.{count}",
+            [value for item in items for value in item],
+        )
+
+
+def _group_counts(kind, queryset, field):
+    qs = queryset.order_by().values_list(field).annotate(n=Count("id"))
+    return Counter({(kind, str(key)): n for key, n in qs})
+
+
+@transaction.atomic
+def rebuild():
+    """Recomputes all the counts from the resource and location tables"""
+    connection = connections[router.db_for_write(Statistic)]
+    with connection.cursor() as cursor:
+        # blocks concurrent updates until the new counts are committed
+        cursor.execute(
+            "LOCK TABLE {} IN EXCLUSIVE MODE".format(
+                connection.ops.quote_name(Statistic._meta.db_table)
+            )
+        )
+    counts = Counter({(Kind.TOTAL, ""): Resource.objects.count()})
+    counts.update(_group_counts(Kind.DTYPE, Resource.objects, "dtype_id"))
+    counts.update(_group_counts(Kind.CREATOR, Resource.objects, "created_by_id"))
+    counts.update(_group_counts(Kind.ARCHIVE, Location.objects, "archive_id"))
+    months = (
+        Resource.objects.order_by()
+        .annotate(month=TruncMonth("created_on"))
+        .values_list("month")
+        .annotate(n=Count("id"))
+    )
+    counts.update({(Kind.MONTH, month_key(month)): n for month, n in months})
+    Statistic.objects.all().delete()
+    Statistic.objects.bulk_create(
+        Statistic(kind=kind, key=key, count=n) for (kind, key), n in counts.items()
+    )
+    return counts
+
+
+def summary():
+    """Returns the current counts, with groups identified by name"""
+    rows = Statistic.objects.filter(count__gt=0).values_list("kind", "key", "count")
+    by_kind = {kind: {} for kind in Kind.values}
+    for kind, key, count in rows:
+        by_kind[kind][key] = count
+    dtypes = caching.datatype_index()["pk"]
+    archives = caching.archive_index()["pk"]
+    users = dict(
+        User.objects.filter(pk__in=by_kind[Kind.CREATOR]).values_list("pk", "username")
+    )
+    return {
+        "resources": by_kind[Kind.TOTAL].get("", 0),
+        "dtypes": _named(by_kind[Kind.DTYPE], dtypes),
+        "archives": _named(by_kind[Kind.ARCHIVE], archives),
+        "creators": _named(by_kind[Kind.CREATOR], users),
+        "months": dict(sorted(by_kind[Kind.MONTH].items())),
+    }
+
+
+def _named(counts, names):
+    out = {}
+    for key, count in counts.items():
+        name = names.get(int(key))
+        if name is not None:
+            out[str(name)] = count
+    return out
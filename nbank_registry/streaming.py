@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Helpers for streaming responses from the bulk endpoints.
+
+Bulk responses are generated record by record, so they can't be buffered and
+compressed after the fact. If the client accepts it, the stream is compressed
+incrementally, with the compressor flushed after every NEUROBANK_STREAM_BLOCK_SIZE
+bytes of input so that the client can decode records as they arrive. zstd is
+used if the zstandard package is installed and the client prefers it;
+otherwise gzip.
+
+"""
+
+import zlib
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+JSONL_CONTENT_TYPE = "application/x-ndjson"
+
+block_size = getattr(settings, "NEUROBANK_STREAM_BLOCK_SIZE", 64 * 1024)
+gzip_level = getattr(settings, "NEUROBANK_STREAM_GZIP_LEVEL", 6)
+zstd_level = getattr(settings, "NEUROBANK_STREAM_ZSTD_LEVEL", 3)
+
+
+def supported_encodings():
+    if zstandard is not None:
+        return ("zstd", "gzip")
+    return ("gzip",)
+
+
+def accepted_encoding(request):
+    """Returns the content encoding to use for the response, or None.
+
+    Chooses the supported encoding with the highest quality value in the
+    Accept-Encoding header, preferring zstd to gzip on ties.
+
+    """
+    header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+    qualities = {}
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    best = None
+    for encoding in supported_encodings():
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best is not None else None
+
+
+def gzip_stream(chunks):
+    compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    yield from _compress(chunks, compressor, zlib.Z_SYNC_FLUSH)
+
+
+def zstd_stream(chunks):
+    compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+    yield from _compress(chunks, compressor, zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+def _compress(chunks, compressor, flush_mode):
+    pending = 0
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= block_size:
+            out += compressor.flush(flush_mode)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+ENCODERS = {"gzip": gzip_stream, "zstd": zstd_stream}
+
+
+def streaming_response(request, chunks, content_type=JSONL_CONTENT_TYPE):
+    """Returns a StreamingHttpResponse for an iterable of byte strings.
+
+    The content is compressed if the client accepts a supported encoding.
+
+    """
+    encoding = accepted_encoding(request)
+    if encoding is not None:
+        chunks = ENCODERS[encoding](chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    if encoding is not None:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -10,6 +10,7 @@ DATABASES = {
         "PORT": os.environ.get("POSTGRES_PORT", "5432"),
     }
 }
+DATABASE_ROUTERS = ["nbank_registry.routers.ReplicaRouter"]
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -33,6 +34,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "nbank_registry.middleware.ReplicaMiddleware",
 ]
 
 TEMPLATES = [
@@ -52,5 +54,6 @@ TEMPLATES = [
 ]
 
 USE_TZ = True
+STATIC_URL = "static/"
 DEBUG = True
 ROOT_URLCONF = "nbank_registry.tests.urls"
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+from unittest import mock
+
+from django.contrib.admin import widgets
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from nbank_registry import admin
+from nbank_registry.models import Archive, DataType, Location, Resource
+
+
+class ResourceAdminTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            username="admin", password="password1", email="admin@domain.com"
+        )
+        self.client.force_login(self.user)
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.archive = Archive.objects.create(
+            name="local", scheme="neurobank", root="/home/data/starlings"
+        )
+
+    def create_resources(self, n):
+        for _ in range(n):
+            resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+            Location.objects.create(resource=resource, archive=self.archive)
+
+    def get_changelist(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("admin:nbank_registry_resource_changelist"), params
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.create_resources(2)
+        _, n_queries = self.get_changelist()
+        self.create_resources(20)
+        response, n_queries_more = self.get_changelist()
+        self.assertEqual(n_queries_more, n_queries)
+        self.assertContains(response, "22 resources")
+        self.assertLessEqual(n_queries, 10)
+
+    def test_changelist_search(self):
+        self.create_resources(3)
+        resource = Resource.objects.create(
+            dtype=self.dtype, created_by=self.user, metadata={"area": "HVC"}
+        )
+        response, _ = self.get_changelist(q="HVC")
+        self.assertContains(response, resource.name)
+        self.assertEqual(response.context["cl"].result_count, 1)
+        response, _ = self.get_changelist(q=resource.name[:6])
+        self.assertContains(response, resource.name)
+
+    def test_changelist_uses_estimated_count(self):
+        self.create_resources(3)
+        # the dtype filter is only shown if there is more than one choice
+        DataType.objects.create(name="acoustic_waveform")
+        with (
+            mock.patch.object(admin, "APPROXIMATE_COUNT_THRESHOLD", 1000),
+            mock.patch.object(admin, "estimated_count", return_value=5000),
+        ):
+            response, _ = self.get_changelist()
+            self.assertEqual(response.context["cl"].result_count, 5000)
+            # filtered lists are counted exactly
+            response, _ = self.get_changelist(dtype__id__exact=self.dtype.pk)
+            self.assertEqual(response.context["cl"].result_count, 3)
+
+    def test_estimated_count(self):
+        self.create_resources(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE nbank_registry_resource")
+        self.assertEqual(admin.estimated_count(Resource.objects.all()), 3)
+
+    def test_change_form_uses_autocomplete(self):
+        self.create_resources(1)
+        resource = Resource.objects.get()
+        response = self.client.get(
+            reverse("admin:nbank_registry_resource_change", args=[resource.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        form = response.context["adminform"].form
+        for field in ("dtype", "created_by"):
+            self.assertIsInstance(
+                form.fields[field].widget.widget, widgets.AutocompleteSelect
+            )
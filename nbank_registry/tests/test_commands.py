@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from nbank_registry import resource_download
+from nbank_registry.models import (
+    Archive,
+    DataType,
+    Location,
+    MetadataIndex,
+    Resource,
+    Statistic,
+)
+from nbank_registry.views import filter_metadata
+
+
+class PopulateRegistryTests(TestCase):
+    def populate(self, *args):
+        call_command("populate_registry", *args, stdout=StringIO())
+
+    def test_populate_creates_records(self):
+        self.populate("250", "--dtypes=3", "--archives=2", "--batch-size=100")
+        self.assertEqual(Resource.objects.count(), 250)
+        self.assertEqual(DataType.objects.count(), 3)
+        self.assertEqual(Archive.objects.count(), 2)
+        self.assertGreaterEqual(Location.objects.count(), 250)
+        self.assertFalse(Resource.objects.filter(metadata__isnull=True).exists())
+
+    def test_populate_is_deterministic(self):
+        self.populate("50", "--seed=10")
+        first = list(Resource.objects.order_by("name").values_list("name", "metadata"))
+        Resource.objects.all().delete()
+        self.populate("50", "--seed=10")
+        second = list(Resource.objects.order_by("name").values_list("name", "metadata"))
+        self.assertEqual(first, second)
+
+    def test_populate_locations_are_deterministic(self):
+        def locations():
+            return list(
+                Location.objects.order_by(
+                    "resource__name", "archive__name"
+                ).values_list("resource__name", "archive__name")
+            )
+
+        self.populate("50", "--archives=4", "--max-locations=3", "--seed=10")
+        first = locations()
+        Resource.objects.all().delete()
+        self.populate("50", "--archives=4", "--max-locations=3", "--seed=10")
+        self.assertEqual(locations(), first)
+
+    def test_populate_reports_new_resources(self):
+        self.populate("30", "--seed=10")
+        out = StringIO()
+        call_command("populate_registry", "40", "--seed=10", stdout=out)
+        self.assertEqual(Resource.objects.count(), 40)
+        self.assertIn("10 new resources (30 already existed)", out.getvalue())
+
+    def test_populate_uses_requested_dtypes_and_archives(self):
+        self.populate("20", "--dtypes=10", "--archives=6", "--seed=10")
+        existing = list(Resource.objects.values_list("pk", flat=True))
+        self.populate("20", "--dtypes=3", "--archives=2", "--seed=11")
+        new = Resource.objects.exclude(pk__in=existing)
+        self.assertEqual(new.count(), 20)
+        dtypes = set(new.values_list("dtype__name", flat=True))
+        self.assertLessEqual(dtypes, {f"synthetic-dtype-{i}" for i in range(3)})
+        archives = set(
+            Location.objects.filter(resource__in=new).values_list(
+                "archive__name", flat=True
+            )
+        )
+        self.assertLessEqual(archives, {f"synthetic-archive-{i}" for i in range(2)})
+
+    def test_populate_needs_a_location(self):
+        for value in ("0", "-1"):
+            with self.assertRaises(CommandError):
+                self.populate("10", f"--max-locations={value}")
+
+
+class RebuildStatsTests(TestCase):
+    def test_rebuild_counts_populated_records(self):
+        call_command("populate_registry", "50", "--archives=2", stdout=StringIO())
+        Statistic.objects.all().delete()
+        call_command("rebuild_stats", stdout=StringIO())
+        total = Statistic.objects.get(kind=Statistic.Kind.TOTAL)
+        self.assertEqual(total.count, Resource.objects.count())
+        archives = Statistic.objects.filter(kind=Statistic.Kind.ARCHIVE)
+        self.assertEqual(sum(stat.count for stat in archives), Location.objects.count())
+
+
+class UpdateDownloadFieldsTests(TestCase):
+    def expected_fields(self):
+        return {
+            resource.name: (
+                resource_download.resource_filename(
+                    resource.name, resource.dtype.extension
+                ),
+                resource.dtype.downloadable
+                and resource_download.has_local_location(resource),
+            )
+            for resource in Resource.objects.select_related("dtype")
+        }
+
+    def stored_fields(self):
+        return {
+            name: (filename, downloadable)
+            for name, filename, downloadable in Resource.objects.values_list(
+                "name", "filename", "downloadable"
+            )
+        }
+
+    def test_update_download_fields(self):
+        call_command("populate_registry", "50", "--dtypes=4", stdout=StringIO())
+        expected = self.expected_fields()
+        self.assertTrue(any(downloadable for _, downloadable in expected.values()))
+        self.assertEqual(self.stored_fields(), expected)
+        Resource.objects.update(filename="", downloadable=False)
+        out = StringIO()
+        call_command("update_download_fields", "--batch-size=7", stdout=out)
+        self.assertIn("updated 50 resources", out.getvalue())
+        self.assertEqual(self.stored_fields(), expected)
+
+    def test_update_download_fields_needs_positive_batch_size(self):
+        for value in ("0", "-1"):
+            with self.assertRaises(CommandError):
+                call_command(
+                    "update_download_fields", f"--batch-size={value}", stdout=StringIO()
+                )
+
+
+class SyncMetadataIndexesTests(TransactionTestCase):
+    # CREATE INDEX CONCURRENTLY can't run inside the TestCase transaction
+
+    def tearDown(self):
+        # indexes are not removed when the tables are flushed
+        MetadataIndex.objects.all().delete()
+        self.sync()
+
+    def sync(self, *args):
+        call_command("sync_metadata_indexes", *args, stdout=StringIO())
+
+    def indexes(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Resource._meta.db_table
+            )
+        return {name for name in constraints if name.startswith("nbank_md_")}
+
+    def test_sync_creates_and_drops_indexes(self):
+        dtype = DataType.objects.create(name="spike_times")
+        index = MetadataIndex.objects.create(dtype=dtype, key="experimenter")
+        self.sync("--dry-run")
+        self.assertEqual(self.indexes(), set())
+        self.sync()
+        self.assertEqual(self.indexes(), {index.index_name})
+        self.sync()
+        index.delete()
+        self.sync()
+        self.assertEqual(self.indexes(), set())
+
+    def test_metadata_filter_uses_index(self):
+        dtype = DataType.objects.create(name="spike_times")
+        index = MetadataIndex.objects.create(dtype=dtype, key="experimenter")
+        self.sync()
+        qs = filter_metadata(
+            Resource.objects.all(),
+            {"dtype": "spike_times", "metadata__experimenter": "dmeliza"},
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+        try:
+            plan = qs.order_by().explain()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET enable_seqscan")
+        self.assertIn(index.index_name, plan)
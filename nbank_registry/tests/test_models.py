@@ -3,7 +3,8 @@
 from django.contrib.auth import get_user_model
 from django.test import TestCase
 
-from nbank_registry.models import DataType, Resource
+from nbank_registry import resource_download
+from nbank_registry.models import Archive, DataType, Location, Resource
 
 
 def get_sentinel_user():
@@ -20,10 +21,10 @@ class ResourceModelTests(TestCase):
             extension="wav",
         )
         resource = Resource.objects.create(name="abc", dtype=dtype, created_by=user)
-        self.assertEqual(resource.filename(), "abc.wav")
+        self.assertEqual(resource.filename, "abc.wav")
 
         resource = Resource.objects.create(name="abc.rst", dtype=dtype, created_by=user)
-        self.assertEqual(resource.filename(), "abc.rst")
+        self.assertEqual(resource.filename, "abc.rst")
 
         dtype = DataType.objects.create(
             name="intracellular-abfdir",
@@ -33,10 +34,10 @@ class ResourceModelTests(TestCase):
         )
 
         resource = Resource.objects.create(name="def", dtype=dtype, created_by=user)
-        self.assertEqual(resource.filename(), "def")
+        self.assertEqual(resource.filename, "def")
 
         resource = Resource.objects.create(name="def.txt", dtype=dtype, created_by=user)
-        self.assertEqual(resource.filename(), "def.txt")
+        self.assertEqual(resource.filename, "def.txt")
 
         dtype = DataType.objects.create(
             name="eeg-arf",
@@ -45,4 +46,71 @@ class ResourceModelTests(TestCase):
             extension=".arf",
         )
         resource = Resource.objects.create(name="qqr", dtype=dtype, created_by=user)
-        self.assertEqual(resource.filename(), "qqr.arf")
+        self.assertEqual(resource.filename, "qqr.arf")
+
+    def test_filename_expression_matches(self):
+        user = get_sentinel_user()
+        names = ("abc", "abc.rst", "abc.", ".abc", "a..b", "a.b.c")
+        for extension in ("wav", ".arf", ""):
+            dtype = DataType.objects.create(
+                name=f"dtype{extension}", extension=extension
+            )
+            for name in names:
+                Resource.objects.create(
+                    name=f"{extension}{name}", dtype=dtype, created_by=user
+                )
+        expected = dict(Resource.objects.values_list("name", "filename"))
+        Resource.objects.update(filename="")
+        resource_download.update_download_fields(Resource.objects.all())
+        self.assertEqual(
+            dict(Resource.objects.values_list("name", "filename")), expected
+        )
+
+
+class DownloadFieldsTests(TestCase):
+    def setUp(self):
+        self.user = get_sentinel_user()
+        self.dtype = DataType.objects.create(
+            name="vocalization-wav", downloadable=True, extension="wav"
+        )
+        self.archive = Archive.objects.create(
+            name="local", scheme="neurobank", root="/home/data/starlings"
+        )
+        self.resource = Resource.objects.create(
+            name="abc", dtype=self.dtype, created_by=self.user
+        )
+
+    def assertDownloadFields(self, filename, downloadable):
+        self.resource.refresh_from_db()
+        self.assertEqual(self.resource.filename, filename)
+        self.assertEqual(self.resource.downloadable, downloadable)
+
+    def test_locations_update_downloadable(self):
+        self.assertDownloadFields("abc.wav", False)
+        remote = Archive.objects.create(name="web", scheme="https", root="example.org")
+        Location.objects.create(resource=self.resource, archive=remote)
+        self.assertDownloadFields("abc.wav", False)
+        location = Location.objects.create(resource=self.resource, archive=self.archive)
+        self.assertDownloadFields("abc.wav", True)
+        location.delete()
+        self.assertDownloadFields("abc.wav", False)
+
+    def test_dtype_changes_update_resources(self):
+        Location.objects.create(resource=self.resource, archive=self.archive)
+        self.dtype.extension = "flac"
+        self.dtype.save()
+        self.assertDownloadFields("abc.flac", True)
+        self.dtype.downloadable = False
+        self.dtype.save()
+        self.assertDownloadFields("abc.flac", False)
+        other = DataType.objects.create(name="other", downloadable=True)
+        self.resource.dtype = other
+        self.resource.save()
+        self.assertDownloadFields("abc", True)
+
+    def test_archive_scheme_changes_update_resources(self):
+        Location.objects.create(resource=self.resource, archive=self.archive)
+        self.assertDownloadFields("abc.wav", True)
+        self.archive.scheme = "tape"
+        self.archive.save()
+        self.assertDownloadFields("abc.wav", False)
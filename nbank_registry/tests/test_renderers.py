@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+import datetime
+import decimal
+import uuid
+from unittest import mock
+
+from django.test import SimpleTestCase
+from rest_framework.renderers import JSONRenderer
+
+from nbank_registry import renderers
+
+SAMPLE = {
+    "name": "résumé",
+    "count": 3,
+    "ratio": 0.25,
+    "flag": True,
+    "missing": None,
+    "uuid": uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    "created_on": datetime.datetime(
+        2024, 5, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc
+    ),
+    "date": datetime.date(2024, 5, 1),
+    "amount": decimal.Decimal("1.50"),
+    "separator": "a\u2028b\u2029c",
+    "metadata": {"nested": [1, "two", {"three": 3.0}], 4: "int key"},
+}
+
+
+class FastJSONRendererTests(SimpleTestCase):
+    def test_output_matches_json_renderer(self):
+        expected = JSONRenderer().render(SAMPLE)
+        self.assertEqual(renderers.FastJSONRenderer().render(SAMPLE), expected)
+
+    def test_indented_output_matches_json_renderer(self):
+        media_type = "application/json; indent=2"
+        expected = JSONRenderer().render(SAMPLE, media_type)
+        self.assertEqual(
+            renderers.FastJSONRenderer().render(SAMPLE, media_type), expected
+        )
+
+    def test_fallback_without_orjson(self):
+        with mock.patch.object(renderers, "orjson", None):
+            out = renderers.FastJSONRenderer().render(SAMPLE)
+        self.assertEqual(out, JSONRenderer().render(SAMPLE))
+
+    def test_jsonl_renderer_appends_newline(self):
+        out = renderers.JSONLRenderer().render({"name": "a"})
+        self.assertEqual(out, b'{"name":"a"}\n')
+
+    def test_default_renderers_replace_json_renderer(self):
+        self.assertIn(renderers.FastJSONRenderer, renderers.DEFAULT_RENDERER_CLASSES)
+        self.assertNotIn(JSONRenderer, renderers.DEFAULT_RENDERER_CLASSES)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+from unittest import mock
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.urls import resolve, reverse
+
+from nbank_registry import caching, middleware, routers
+from nbank_registry.models import Resource
+
+
+@mock.patch.object(routers, "replica_alias", "replica")
+class ReplicaRoutingTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.factory = RequestFactory()
+        caching.get_cache().clear()
+
+    def request(self, method, url_name, view=None, remote_addr="10.0.0.1", **kwargs):
+        """Passes a request through the middleware and returns the read alias.
+
+        If `view` is supplied, it's called in place of the view after the read
+        alias is recorded.
+
+        """
+        url = reverse(f"neurobank:{url_name}", kwargs=kwargs)
+        request = getattr(self.factory, method.lower())(url, REMOTE_ADDR=remote_addr)
+        request.resolver_match = resolve(request.path_info)
+        seen = {}
+
+        def get_response(request):
+            mw.process_view(request, None, (), {})
+            seen["db"] = self.router.db_for_read(Resource)
+            if view is not None:
+                view()
+                seen["after"] = self.router.db_for_read(Resource)
+            return HttpResponse()
+
+        mw = middleware.ReplicaMiddleware(get_response)
+        mw(request)
+        return seen
+
+    def test_no_request_uses_default(self):
+        self.assertIsNone(self.router.db_for_read(Resource))
+
+    def test_read_only_views_use_replica(self):
+        self.assertEqual(self.request("GET", "resource-list")["db"], "replica")
+        self.assertEqual(self.request("GET", "resource", name="x")["db"], "replica")
+        self.assertEqual(
+            self.request("GET", "location-list", resource_name="x")["db"], "replica"
+        )
+        self.assertEqual(self.request("GET", "datatype-list")["db"], "replica")
+        self.assertEqual(self.request("POST", "bulk-resource-list")["db"], "replica")
+        self.assertEqual(self.request("POST", "bulk-location-list")["db"], "replica")
+
+    def test_caches_filled_from_default(self):
+        token = routers.set_state(routers.RoutingState(use_replica=True))
+        try:
+            self.assertEqual(Resource.objects.all().db, "replica")
+            with mock.patch.object(caching, "_index", lambda queryset: queryset.db):
+                self.assertEqual(caching.datatype_index(), "default")
+                self.assertEqual(caching.archive_index(), "default")
+        finally:
+            routers.reset_state(token)
+
+    def test_other_views_use_default(self):
+        self.assertIsNone(self.request("POST", "resource-list")["db"])
+        self.assertIsNone(self.request("PATCH", "resource", name="x")["db"])
+        self.assertIsNone(self.request("GET", "change-list")["db"])
+
+    def test_state_is_reset_after_request(self):
+        self.request("GET", "resource-list")
+        self.assertIsNone(self.router.db_for_read(Resource))
+
+    def test_write_pins_request_to_default(self):
+        seen = self.request(
+            "GET", "resource-list", view=lambda: self.router.db_for_write(Resource)
+        )
+        self.assertEqual(seen["db"], "replica")
+        self.assertIsNone(seen["after"])
+
+    def test_sticky_window_after_write(self):
+        def write():
+            self.router.db_for_write(Resource)
+
+        with mock.patch.object(middleware, "sticky_seconds", 10):
+            self.request("POST", "resource-list", view=write)
+            self.assertIsNone(self.request("GET", "resource-list")["db"])
+            self.assertEqual(
+                self.request("GET", "resource-list", remote_addr="10.0.0.2")["db"],
+                "replica",
+            )
+
+    def test_no_sticky_window_by_default(self):
+        def write():
+            self.router.db_for_write(Resource)
+
+        self.request("POST", "resource-list", view=write)
+        self.assertEqual(self.request("GET", "resource-list")["db"], "replica")
+
+    def test_streaming_content_reads_from_replica(self):
+        url = reverse("neurobank:bulk-resource-list")
+        request = self.factory.post(url)
+        request.resolver_match = resolve(request.path_info)
+
+        def chunks():
+            yield str(self.router.db_for_read(Resource)).encode()
+
+        def get_response(request):
+            mw.process_view(request, None, (), {})
+            return StreamingHttpResponse(chunks())
+
+        mw = middleware.ReplicaMiddleware(get_response)
+        response = mw(request)
+        self.assertIsNone(self.router.db_for_read(Resource))
+        self.assertEqual(b"".join(response.streaming_content), b"replica")
+
+    def test_replica_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate("replica", "nbank_registry"))
+        self.assertIsNone(self.router.allow_migrate("default", "nbank_registry"))
@@ -1,20 +1,54 @@
 # -*- coding: utf-8 -*-
 # -*- mode: python -*-
+import datetime
 import hashlib
+import itertools
 import json
 import os
 import posixpath as ppath
+import struct
 import tempfile
+import threading
+import time
+import types
 import unittest
 import uuid
+import zlib
+from unittest import mock
+from urllib.parse import urlencode
 
 from django.contrib.auth.models import Permission, User
-from django.test import override_settings
+from django.db import connection, transaction
+from django.db.models.expressions import RawSQL
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import ParseError
 from rest_framework.test import APITestCase
 
-from nbank_registry.models import Archive, DataType, Location, Resource
+from nbank_registry import (
+    caching,
+    guards,
+    parsers,
+    renderers,
+    resource_download,
+    stats,
+    streaming,
+    throttling,
+    views,
+)
+from nbank_registry.models import (
+    Archive,
+    Change,
+    DataType,
+    Location,
+    MetadataIndex,
+    Resource,
+    Statistic,
+)
+from nbank_registry.serializers import ResourceSerializer
 from nbank_registry.views import DOWNLOAD_ARCHIVE_NAME
 
 
@@ -29,6 +63,8 @@ class APIAuthTestCase(APITestCase):
         self.client.logout()
 
     def setUp(self):
+        # the database is rolled back between tests without sending signals
+        caching.get_cache().clear()
         self.user = User.objects.create_superuser(
             username=self.username, password=self.password, email="user@domain.com"
         )
@@ -166,7 +202,7 @@ class ResourceTests(APIAuthTestCase):
                 "name": str(self.resource),
                 "sha1": self.resource.sha1,
                 "dtype": self.dtype.name,
-                "filename": self.resource.filename(),
+                "filename": self.resource.filename,
                 "created_by": self.user.username,
                 "metadata": self.resource.metadata,
                 "locations": [self.archive.name],
@@ -197,13 +233,87 @@ class ResourceTests(APIAuthTestCase):
                 "name": str(self.resource),
                 "sha1": self.resource.sha1,
                 "dtype": self.dtype.name,
-                "filename": self.resource.filename(),
+                "filename": self.resource.filename,
                 "created_by": self.user.username,
                 "metadata": self.resource.metadata,
                 "locations": [self.archive.name],
             },
         )
 
+    def test_bulk_access_resource_detail_compressed(self):
+        resources = [self.resource] + [
+            Resource.objects.create(
+                dtype=self.dtype, created_by=self.user, metadata={"unit": i}
+            )
+            for i in range(50)
+        ]
+        query = {"names": [r.name for r in resources]}
+        url = reverse("neurobank:bulk-resource-list")
+        response = self.client.post(url, query, format="json")
+        self.assertNotIn("Content-Encoding", response)
+        expected = b"".join(response.streaming_content)
+        with mock.patch.object(streaming, "block_size", 256):
+            response = self.client.post(
+                url, query, format="json", HTTP_ACCEPT_ENCODING="gzip, deflate"
+            )
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertIn("Accept-Encoding", response["Vary"])
+            chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 2)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        blocks = [decompressor.decompress(chunk) for chunk in chunks]
+        # each flushed block should decode to complete records
+        for block in blocks:
+            self.assertTrue(block == b"" or block.endswith(b"\n"))
+        self.assertEqual(b"".join(blocks), expected)
+
+    @unittest.skipIf(streaming.zstandard is None, "zstandard is not installed")
+    def test_bulk_access_resource_detail_zstd(self):
+        query = {"names": [self.resource.name]}
+        url = reverse("neurobank:bulk-resource-list")
+        response = self.client.post(
+            url, query, format="json", HTTP_ACCEPT_ENCODING="gzip;q=0.5, zstd"
+        )
+        self.assertEqual(response["Content-Encoding"], "zstd")
+        reader = streaming.zstandard.ZstdDecompressor().decompressobj()
+        data = reader.decompress(b"".join(response.streaming_content))
+        self.assertEqual(json.loads(data)["name"], self.resource.name)
+
+    @unittest.skipIf(renderers.msgpack is None, "msgpack is not installed")
+    def test_bulk_access_resource_detail_msgpack(self):
+        resource = Resource.objects.create(
+            dtype=self.dtype, created_by=self.user, metadata={"unit": 1}
+        )
+        query = {"names": [self.resource.name, resource.name]}
+        response = self.client.post(
+            reverse("neurobank:bulk-resource-list"),
+            query,
+            format="json",
+            HTTP_ACCEPT=renderers.MSGPACK_MEDIA_TYPE,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], renderers.MSGPACK_MEDIA_TYPE)
+        content = b"".join(response.streaming_content)
+        records = []
+        while content:
+            (size,) = struct.unpack(">I", content[:4])
+            records.append(renderers.msgpack.unpackb(content[4 : 4 + size]))
+            content = content[4 + size :]
+        self.assertEqual({r["name"] for r in records}, set(query["names"]))
+        self.assertEqual(
+            next(r for r in records if r["name"] == resource.name)["metadata"],
+            {"unit": 1},
+        )
+
+    @unittest.skipIf(renderers.msgpack is None, "msgpack is not installed")
+    def test_resource_list_msgpack(self):
+        response = self.client.get(
+            reverse("neurobank:resource-list"), HTTP_ACCEPT=renderers.MSGPACK_MEDIA_TYPE
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = renderers.msgpack.unpackb(response.content)
+        self.assertEqual(data[0]["name"], self.resource.name)
+
     def test_cannot_bulk_access_resource_with_empty_list(self):
         query = {"names": []}
         response = self.client.post(
@@ -218,6 +328,304 @@ class ResourceTests(APIAuthTestCase):
         )
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_bulk_access_resource_with_names_not_list(self):
+        query = {"names": self.resource.name}
+        response = self.client.post(
+            reverse("neurobank:bulk-resource-list"), query, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch.object(views, "bulk_max_names", 2)
+    def test_cannot_bulk_access_too_many_names(self):
+        query = {"names": [self.resource.name, "a", "b"]}
+        for url in ("neurobank:bulk-resource-list", "neurobank:bulk-location-list"):
+            response = self.client.post(reverse(url), query, format="json")
+            self.assertEqual(
+                response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+    @mock.patch.object(views, "bulk_chunk_size", 2)
+    def test_bulk_access_resources_in_chunks(self):
+        resources = [self.resource] + [
+            Resource.objects.create(dtype=self.dtype, created_by=self.user)
+            for _ in range(4)
+        ]
+        names = [r.name for r in resources]
+        query = {"names": names + names[:2] + ["no-such-resource"]}
+        caching.datatype_index(), caching.archive_index()
+        # each chunk of names needs one query for resources and one for locations
+        with self.assertNumQueries(6):
+            response = self.client.post(
+                reverse("neurobank:bulk-resource-list"), query, format="json"
+            )
+            data = [json.loads(record) for record in response]
+        self.assertEqual([r["name"] for r in data], sorted(names))
+        for record in data:
+            expected = (
+                [self.archive.name] if record["name"] == self.resource.name else []
+            )
+            self.assertEqual(record["locations"], expected)
+
+    @mock.patch.object(views, "bulk_chunk_size", 2)
+    def test_bulk_access_locations_in_chunks(self):
+        resources = [self.resource] + [
+            Resource.objects.create(dtype=self.dtype, created_by=self.user)
+            for _ in range(2)
+        ]
+        for resource in resources[1:]:
+            Location.objects.create(resource=resource, archive=self.archive)
+        names = [r.name for r in resources]
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse("neurobank:bulk-location-list"), {"names": names}, format="json"
+            )
+            data = [json.loads(record) for record in response]
+        self.assertEqual([r["name"] for r in data], sorted(names))
+
+    @mock.patch.object(views, "bulk_chunk_size", 2)
+    def test_bulk_access_resources_resumable(self):
+        names = ["b", "B", "a-2", "a_1", self.resource.name]
+        for name in names[:-1]:
+            Resource.objects.create(name=name, dtype=self.dtype, created_by=self.user)
+        url = reverse("neurobank:bulk-resource-list")
+        response = self.client.post(url, {"names": names, "after": ""}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = [json.loads(record) for record in response]
+        # order does not depend on the database collation
+        self.assertEqual([r["name"] for r in data[:-1]], sorted(names))
+        self.assertEqual(data[-1], {"trailer": {"last": max(names), "count": 5}})
+        # resume after the second record
+        after = data[1]["name"]
+        response = self.client.post(
+            url, {"names": names, "after": after}, format="json"
+        )
+        resumed = [json.loads(record) for record in response]
+        self.assertEqual(resumed[:-1], data[2:-1])
+        self.assertEqual(resumed[-1]["trailer"]["count"], 3)
+        # nothing left
+        response = self.client.post(
+            url, {"names": names, "after": max(names)}, format="json"
+        )
+        self.assertEqual(
+            [json.loads(record) for record in response],
+            [{"trailer": {"last": max(names), "count": 0}}],
+        )
+
+    def test_bulk_access_resources_bad_after(self):
+        query = {"names": [self.resource.name], "after": 1}
+        for url in ("neurobank:bulk-resource-list", "neurobank:bulk-location-list"):
+            response = self.client.post(reverse(url), query, format="json")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_access_locations_resumable(self):
+        names = ["b", "B", "a_1", self.resource.name]
+        for name in names[:-1]:
+            resource = Resource.objects.create(
+                name=name, dtype=self.dtype, created_by=self.user
+            )
+            Location.objects.create(resource=resource, archive=self.archive)
+        url = reverse("neurobank:bulk-location-list")
+        for best in (False, True):
+            query = {"names": names, "after": "B", "best": best}
+            response = self.client.post(url, query, format="json")
+            data = [json.loads(record) for record in response]
+            expected = [name for name in sorted(names) if name > "B"]
+            self.assertEqual([r["name"] for r in data[:-1]], expected)
+            self.assertEqual(
+                data[-1], {"trailer": {"last": expected[-1], "count": len(expected)}}
+            )
+
+    def post_ndjson(self, url, names, **params):
+        body = "".join(json.dumps(name) + "\n" for name in names)
+        if params:
+            url = f"{url}?{urlencode(params)}"
+        return self.client.post(
+            url, body, content_type="application/x-ndjson; charset=utf-8"
+        )
+
+    @mock.patch.object(views, "bulk_chunk_size", 2)
+    def test_bulk_access_resources_ndjson(self):
+        names = sorted(
+            [self.resource.name]
+            + [
+                Resource.objects.create(dtype=self.dtype, created_by=self.user).name
+                for _ in range(4)
+            ]
+        )
+        url = reverse("neurobank:bulk-resource-list")
+        caching.datatype_index(), caching.archive_index()
+        # each chunk needs one query for resources and one for locations
+        with self.assertNumQueries(6):
+            response = self.post_ndjson(url, names + ["no-such-resource"], after="")
+            data = [json.loads(record) for record in response]
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["name"] for r in data[:-1]], names)
+        self.assertEqual(data[-1], {"trailer": {"last": names[-1], "count": 5}})
+        response = self.post_ndjson(url, names, after=names[2])
+        data = [json.loads(record) for record in response]
+        self.assertEqual([r["name"] for r in data[:-1]], names[3:])
+
+    @mock.patch.object(views, "bulk_chunk_size", 2)
+    def test_bulk_access_ndjson_resumable_in_any_order(self):
+        names = sorted(
+            [self.resource.name]
+            + [
+                Resource.objects.create(dtype=self.dtype, created_by=self.user).name
+                for _ in range(4)
+            ]
+        )
+        url = reverse("neurobank:bulk-resource-list")
+        unsorted = names[::-1] + names[:1]
+        response = self.post_ndjson(url, unsorted, after=names[0])
+        data = [json.loads(record) for record in response]
+        self.assertEqual([r["name"] for r in data[:-1]], names[1:])
+        self.assertEqual(data[-1], {"trailer": {"last": names[-1], "count": 4}})
+        # errors anywhere in the stream are found before the response starts
+        body = "".join(json.dumps(name) + "\n" for name in unsorted) + "bad\n"
+        response = self.client.post(
+            f"{url}?after=", body, content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with mock.patch.object(views, "bulk_max_names", 4):
+            response = self.post_ndjson(url, unsorted, after="")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_bulk_access_locations_ndjson(self):
+        archive = Archive.objects.create(
+            name="remote",
+            scheme="https",
+            root="example.org",
+            accessibility=Archive.Accessibility.REMOTE,
+        )
+        Location.objects.create(resource=self.resource, archive=archive)
+        url = reverse("neurobank:bulk-location-list")
+        response = self.post_ndjson(url, [self.resource.name])
+        data = [json.loads(record) for record in response]
+        self.assertEqual(len(data), 1)
+        self.assertEqual(len(data[0]["locations"]), 2)
+        response = self.post_ndjson(url, [self.resource.name], best=1, resolve=1)
+        data = [json.loads(record) for record in response]
+        self.assertEqual(
+            [loc["archive_name"] for loc in data[0]["locations"]], [self.archive.name]
+        )
+        self.assertIn("path", data[0]["locations"][0])
+        response = self.post_ndjson(url, [self.resource.name], archive="remote")
+        data = [json.loads(record) for record in response]
+        self.assertEqual(
+            [loc["archive_name"] for loc in data[0]["locations"]], ["remote"]
+        )
+
+    def test_bulk_access_ndjson_bad_request(self):
+        url = reverse("neurobank:bulk-resource-list")
+        for body in (b"not json\n", b'{"names": []}\n', b"1\n"):
+            response = self.client.post(url, body, content_type="application/x-ndjson")
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            url, b'\n"a"\n\n"b"\n', content_type="application/x-ndjson"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @mock.patch.object(views, "bulk_max_names", 2)
+    def test_bulk_access_ndjson_too_many_names(self):
+        response = self.post_ndjson(
+            reverse("neurobank:bulk-resource-list"), [self.resource.name, "a", "b"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(response.data["detail"].code, "too_many_names")
+
+    def test_ndjson_names_are_read_lazily(self):
+        stream = parsers.NameStream(
+            itertools.chain([b'"a"\n', b'"b"\n', b'"c"\n'], [b"bad\n"])
+        )
+        chunks = stream.chunks(2)
+        self.assertEqual(next(chunks), ["a", "b"])
+        with self.assertRaises(ParseError):
+            next(chunks)
+
+    @mock.patch.object(throttling, "rate", {"anonymous": "3/min"})
+    def test_bulk_ndjson_charged_for_names_read(self):
+        url = reverse("neurobank:bulk-resource-list")
+        response = self.post_ndjson(url, ["a", "b", "c", "d", "e"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        list(response)
+        # the bucket is 2 names in debt, so 3 names are needed to send 1
+        response = self.post_ndjson(url, ["a"])
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response["Retry-After"], "60")
+
+    @mock.patch.object(throttling, "rate", {"anonymous": "3/min"})
+    def test_bulk_access_throttled_by_names(self):
+        url = reverse("neurobank:bulk-resource-list")
+        query = {"names": [self.resource.name, "a"]}
+        response = self.client.post(url, query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(url, query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        # one name refills in 20 s
+        self.assertEqual(response["Retry-After"], "20")
+        query = {"names": [self.resource.name]}
+        response = self.client.post(url, query, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # not throttled at the staff level
+        self.login()
+        response = self.client.post(url, {"names": ["a"] * 10}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @mock.patch.object(throttling, "rate", {"anonymous": "3/min"})
+    @mock.patch.object(views, "bulk_max_names", 2)
+    def test_bulk_access_rejected_requests_are_refunded(self):
+        url = reverse("neurobank:bulk-resource-list")
+        response = self.client.post(url, {"names": ["a", "b", "c"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.post(
+            url, {"names": ["a", "b"], "after": 1}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(url, {"names": ["a", "b"]}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @mock.patch.object(throttling, "rate", {"anonymous": "10/min"})
+    def test_bulk_throttle_is_atomic(self):
+        throttle = throttling.BulkNameThrottle()
+        request = types.SimpleNamespace(
+            user=None, headers={}, META={"REMOTE_ADDR": "10.0.0.2"}
+        )
+        now = time.time()
+
+        def slow_timer():
+            # widens the gap between reading and writing the bucket
+            time.sleep(0.02)
+            return now
+
+        throttle.timer = slow_timer
+        results = []
+        barrier = threading.Barrier(4)
+
+        def take():
+            barrier.wait()
+            results.append(throttle.take(request, 4) is None)
+
+        threads = [threading.Thread(target=take) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # only two requests for 4 names fit in a bucket of 10
+        self.assertEqual(results.count(True), 2)
+
+    @mock.patch.object(throttling, "rate", {"anonymous": "10/min"})
+    def test_bulk_throttle_waits_for_lock(self):
+        throttle = throttling.BulkNameThrottle()
+        request = types.SimpleNamespace(
+            user=None, headers={}, META={"REMOTE_ADDR": "10.0.0.3"}
+        )
+        lock = throttle.get_cache_key(request) + ":lock"
+        caching.get_cache().add(lock, True, 5)
+        with mock.patch.object(throttling, "LOCK_WAIT", 0.05):
+            self.assertEqual(throttle.take(request, 1), 0.05)
+        caching.get_cache().delete(lock)
+        self.assertIsNone(throttle.take(request, 1))
+
     def test_can_access_resource_locations(self):
         response = self.client.get(
             reverse("neurobank:location-list", args=[self.resource.name])
@@ -265,7 +673,7 @@ class ResourceTests(APIAuthTestCase):
         self.assertEqual(len(data), 1)
         res_loc = data[0]
         self.assertEqual(res_loc["name"], self.resource.name)
-        self.assertEqual(res_loc["filename"], self.resource.filename())
+        self.assertEqual(res_loc["filename"], self.resource.filename)
         self.assertEqual(len(res_loc["locations"]), 1)
         self.assertEqual(
             res_loc["locations"][0],
@@ -355,6 +763,109 @@ class ResourceTests(APIAuthTestCase):
             response.data["metadata"] | {"test_field": "value"},
         )
 
+    def test_resource_detail_conditional_get(self):
+        url = reverse("neurobank:resource", args=[self.resource.name])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response["ETag"]
+        self.assertIn("Last-Modified", response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.login()
+        self.client.patch(url, {"metadata": {"quality": "good"}}, format="json")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_resource_detail_conditional_get_depends_on_representation(self):
+        url = reverse("neurobank:resource", args=[self.resource.name])
+        response = self.client.get(url, HTTP_ACCEPT="application/json")
+        self.assertIn("Accept", response["Vary"])
+        etag = response["ETag"]
+        response = self.client.get(
+            url, HTTP_ACCEPT="application/json", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn("Accept", response["Vary"])
+        response = self.client.get(
+            url, HTTP_ACCEPT="application/json; indent=2", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(
+            url,
+            {"format": "json"},
+            HTTP_ACCEPT="application/json",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_resource_detail_conditional_get_follows_dtype(self):
+        # Last-Modified has a resolution of one second
+        yesterday = timezone.now() - datetime.timedelta(days=1)
+        Resource.objects.filter(pk=self.resource.pk).update(modified_on=yesterday)
+        DataType.objects.filter(pk=self.dtype.pk).update(modified_on=yesterday)
+        Archive.objects.update(modified_on=yesterday)
+        url = reverse("neurobank:resource", args=[self.resource.name])
+        response = self.client.get(url)
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        self.dtype.extension = "wav"
+        self.dtype.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_can_delete_metadata_field(self):
+        self.login()
+        response = self.client.patch(
+            reverse("neurobank:resource", args=[self.resource]),
+            {"metadata": {"experimenter": None, "test_field": "value"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["metadata"], {"test_field": "value"})
+
+    def test_can_update_null_metadata(self):
+        resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        self.login()
+        response = self.client.patch(
+            reverse("neurobank:resource", args=[resource]),
+            {"metadata": {"test_field": "value"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["metadata"], {"test_field": "value"})
+
+    def test_cannot_update_metadata_with_non_object(self):
+        self.login()
+        response = self.client.patch(
+            reverse("neurobank:resource", args=[self.resource]),
+            {"metadata": ["a", "b"]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_metadata_update_does_not_clobber_concurrent_update(self):
+        stale = Resource.objects.get(pk=self.resource.pk)
+        # another client updates the record after it was loaded
+        Resource.objects.filter(pk=self.resource.pk).update(
+            metadata={"experimenter": "dmeliza", "unit": "st11_1_1"}
+        )
+        serializer = ResourceSerializer(
+            stale, data={"metadata": {"quality": "good"}}, partial=True
+        )
+        self.assertTrue(serializer.is_valid())
+        serializer.save()
+        self.resource.refresh_from_db()
+        self.assertEqual(
+            self.resource.metadata,
+            {"experimenter": "dmeliza", "unit": "st11_1_1", "quality": "good"},
+        )
+
     @unittest.skip("not implemented")
     def test_can_dry_run_create_resource(self):
         self.login()
@@ -427,6 +938,123 @@ class LocationTests(APIAuthTestCase):
         self.assertEqual(response.data[0]["archive_name"], self.archive.name)
         self.assertEqual(response.data[1]["archive_name"], offline_archive.name)
 
+    def test_location_list_conditional_get(self):
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url)
+        etag = response["ETag"]
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        new_archive = Archive.objects.create(
+            name="secret", scheme="neurobank", root="/home/data/secret"
+        )
+        Location.objects.create(resource=self.resource, archive=new_archive)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+        etag = response["ETag"]
+        Location.objects.filter(resource=self.resource, archive=new_archive).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_location_list_conditional_get_follows_archives(self):
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.archive.root = "/home/data/moved"
+        self.archive.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["root"], "/home/data/moved")
+        etag = response["ETag"]
+        response = self.client.get(url, {"resolve": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_location_list_query_count(self):
+        self.dtype.downloadable = True
+        self.dtype.save()
+        for i in range(5):
+            archive = Archive.objects.create(
+                name=f"archive_{i}", scheme="neurobank", root=f"/home/data/{i}"
+            )
+            Location.objects.create(resource=self.resource, archive=archive)
+        url = reverse("neurobank:location-list", args=[self.resource])
+        # one query for the conditional GET validators and one for the
+        # locations joined to the resource, dtype, and archives
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data), 7)
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {"archive": "archive_1"})
+        self.assertEqual(len(response.data), 1)
+        # the resource has to be looked up when there are no matching locations
+        with self.assertNumQueries(3):
+            response = self.client.get(url, {"archive": "no_such_archive"})
+        self.assertEqual(response.data, [])
+
+    def test_location_list_best(self):
+        offline_archive = Archive.objects.create(
+            name="tape",
+            scheme="tape",
+            root="tape_a:1",
+            accessibility=Archive.Accessibility.OFFLINE,
+        )
+        Location.objects.create(resource=self.resource, archive=offline_archive)
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url, {"best": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["archive_name"], self.archive.name)
+        response = self.client.get(url, {"best": 1, "scheme": "tape"})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["archive_name"], offline_archive.name)
+
+    def test_bulk_location_list_best(self):
+        offline_archive = Archive.objects.create(
+            name="tape",
+            scheme="tape",
+            root="tape_a:1",
+            accessibility=Archive.Accessibility.OFFLINE,
+        )
+        resource = Resource.objects.create(
+            name="an_important_file", dtype=self.dtype, created_by=self.user
+        )
+        Location.objects.create(resource=resource, archive=offline_archive)
+        Location.objects.create(resource=resource, archive=self.archive)
+        Location.objects.create(resource=self.resource, archive=offline_archive)
+        query = {"names": [self.resource.name, resource.name], "best": True}
+        response = self.client.post(
+            reverse("neurobank:bulk-location-list"), query, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = [json.loads(record) for record in response]
+        self.assertEqual([d["name"] for d in data], sorted(query["names"]))
+        for record in data:
+            self.assertEqual(len(record["locations"]), 1)
+            self.assertEqual(record["locations"][0]["archive_name"], self.archive.name)
+
+    def test_location_list_resolve(self):
+        remote_archive = Archive.objects.create(
+            name="remote",
+            scheme="https",
+            root="meliza.org/data/",
+            accessibility=Archive.Accessibility.REMOTE,
+        )
+        Location.objects.create(resource=self.resource, archive=remote_archive)
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url)
+        self.assertNotIn("path", response.data[0])
+        response = self.client.get(url, {"resolve": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [loc["path"] for loc in response.data],
+            [
+                "/home/data/intracellular/resources/a_/a_boring_file",
+                "https://meliza.org/data/a_boring_file",
+            ],
+        )
+
     def test_location_list_404_invalid_resource(self):
         response = self.client.get(reverse("neurobank:location-list", args=["adsadf"]))
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -501,6 +1129,247 @@ class LocationTests(APIAuthTestCase):
         self.assertEqual(self.resource.locations.count(), 2)
 
 
+class ChangeTests(APIAuthTestCase):
+    def setUp(self):
+        super(ChangeTests, self).setUp()
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.archive = Archive.objects.create(
+            name="local", scheme="neurobank", root="/home/data/intracellular"
+        )
+        self.archive_2 = Archive.objects.create(
+            name="other", scheme="neurobank", root="/home/data/other"
+        )
+
+    def get_changes(self, **params):
+        response = self.client.get(reverse("neurobank:change-list"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [json.loads(record) for record in response]
+
+    def test_changes_are_recorded(self):
+        self.login()
+        response = self.client.post(
+            reverse("neurobank:resource-list"),
+            {
+                "dtype": self.dtype.name,
+                "locations": [self.archive.name],
+                "metadata": {},
+            },
+            format="json",
+        )
+        name = response.data["name"]
+        self.client.patch(
+            reverse("neurobank:resource", args=[name]),
+            {"metadata": {"quality": "good"}},
+            format="json",
+        )
+        self.client.post(
+            reverse("neurobank:location-list", args=[name]),
+            {"archive_name": self.archive_2.name},
+            format="json",
+        )
+        self.client.delete(reverse("neurobank:location", args=[name, self.archive]))
+        self.client.delete(reverse("neurobank:resource", args=[name]))
+        changes = self.get_changes()
+        self.assertEqual(
+            [(c["action"], c["resource"], c["archive"]) for c in changes],
+            [
+                ("resource-created", name, None),
+                ("location-added", name, self.archive.name),
+                ("resource-updated", name, None),
+                ("location-added", name, self.archive_2.name),
+                ("location-removed", name, self.archive.name),
+                ("resource-deleted", name, None),
+            ],
+        )
+        seqs = [c["seq"] for c in changes]
+        self.assertEqual(seqs, sorted(seqs))
+
+    def test_changes_after_sequence_number(self):
+        self.login()
+        for _ in range(3):
+            self.client.post(
+                reverse("neurobank:resource-list"), {"dtype": self.dtype.name}
+            )
+        changes = self.get_changes()
+        self.assertEqual(len(changes), 3)
+        self.assertEqual(self.get_changes(after=changes[0]["seq"]), changes[1:])
+        self.assertEqual(self.get_changes(after=changes[-1]["seq"]), [])
+        self.assertEqual(self.get_changes(limit=2), changes[:2])
+
+    def test_changes_bad_request(self):
+        url = reverse("neurobank:change-list")
+        for params in ({"after": "x"}, {"limit": "0"}, {"limit": "-1"}):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_writers_hold_log_lock_until_commit(self):
+        # this test runs in a transaction that hasn't committed yet
+        resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        Change.record(Change.Action.RESOURCE_CREATED, resource)
+        result = {}
+
+        def try_lock():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        "SELECT pg_try_advisory_xact_lock(%s)", [Change.LOG_LOCK]
+                    )
+                    result["locked"] = cursor.fetchone()[0]
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        self.assertFalse(result["locked"])
+
+
+class ChangeLockTests(TransactionTestCase):
+    # the writers have to commit for the lock order to matter
+
+    def setUp(self):
+        caching.get_cache().clear()
+        self.user = User.objects.create_superuser(
+            username="user", password="password1", email="user@domain.com"
+        )
+        self.dtype = DataType.objects.create(name="spike_times")
+
+    def wait_for_log_lock_waiter(self):
+        for _ in range(100):
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT count(*) FROM pg_locks "
+                    "WHERE locktype = 'advisory' AND NOT granted"
+                )
+                if cursor.fetchone()[0]:
+                    return
+            time.sleep(0.05)
+        self.fail("writer never waited for the log lock")
+
+    def test_concurrent_create_and_delete(self):
+        doomed = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        errors = []
+
+        def create():
+            try:
+                serializer = ResourceSerializer(data={"dtype": self.dtype.name})
+                serializer.is_valid(raise_exception=True)
+                serializer.save(created_by=self.user)
+            except Exception as err:
+                errors.append(err)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=create)
+        with transaction.atomic():
+            # another writer holds the log lock while the create starts
+            Change.lock_log()
+            thread.start()
+            self.wait_for_log_lock_waiter()
+            views.ResourceDetail().perform_destroy(doomed)
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            list(Change.objects.values_list("action", flat=True)),
+            [Change.Action.RESOURCE_DELETED, Change.Action.RESOURCE_CREATED],
+        )
+        self.assertEqual(Statistic.objects.get(kind=Statistic.Kind.TOTAL).count, 1)
+
+
+class StatsTests(APIAuthTestCase):
+    def setUp(self):
+        super(StatsTests, self).setUp()
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.dtype_2 = DataType.objects.create(name="stimulus")
+        self.archive = Archive.objects.create(
+            name="local", scheme="neurobank", root="/home/data/intracellular"
+        )
+        self.archive_2 = Archive.objects.create(
+            name="other", scheme="neurobank", root="/home/data/other"
+        )
+
+    def get_stats(self):
+        response = self.client.get(reverse("neurobank:stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def create(self, dtype, locations=()):
+        response = self.client.post(
+            reverse("neurobank:resource-list"),
+            {"dtype": dtype.name, "locations": list(locations)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data["name"]
+
+    def test_empty_registry(self):
+        self.assertEqual(
+            self.get_stats(),
+            {
+                "resources": 0,
+                "dtypes": {},
+                "archives": {},
+                "creators": {},
+                "months": {},
+            },
+        )
+
+    def test_stats_track_changes(self):
+        self.login()
+        name_1 = self.create(self.dtype, [self.archive.name])
+        name_2 = self.create(self.dtype, [self.archive.name, self.archive_2.name])
+        month = stats.month_key(Resource.objects.get(name=name_1).created_on)
+        self.assertEqual(
+            self.get_stats(),
+            {
+                "resources": 2,
+                "dtypes": {"spike_times": 2},
+                "archives": {"local": 2, "other": 1},
+                "creators": {self.username: 2},
+                "months": {month: 2},
+            },
+        )
+        self.client.patch(
+            reverse("neurobank:resource", args=[name_1]),
+            {"dtype": self.dtype_2.name},
+            format="json",
+        )
+        self.client.delete(reverse("neurobank:location", args=[name_2, self.archive]))
+        data = self.get_stats()
+        self.assertEqual(data["dtypes"], {"spike_times": 1, "stimulus": 1})
+        self.assertEqual(data["archives"], {"local": 1, "other": 1})
+        self.client.delete(reverse("neurobank:resource", args=[name_2]))
+        data = self.get_stats()
+        self.assertEqual(data["resources"], 1)
+        self.assertEqual(data["dtypes"], {"stimulus": 1})
+        self.assertEqual(data["archives"], {"local": 1})
+
+    def test_dtype_change_by_save(self):
+        resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        resource.dtype = self.dtype_2
+        resource.save()
+        self.assertEqual(self.get_stats()["dtypes"], {"stimulus": 1})
+
+    def test_rebuild_matches_incremental_counts(self):
+        self.login()
+        self.create(self.dtype, [self.archive.name])
+        self.create(self.dtype_2, [self.archive_2.name])
+        expected = self.get_stats()
+        Statistic.objects.all().delete()
+        self.assertEqual(self.get_stats()["resources"], 0)
+        stats.rebuild()
+        self.assertEqual(self.get_stats(), expected)
+
+    def test_stats_query_count(self):
+        self.login()
+        self.create(self.dtype, [self.archive.name])
+        self.logout()
+        self.get_stats()
+        # statistics and creator names; dtypes and archives are cached
+        with self.assertNumQueries(2):
+            self.client.get(reverse("neurobank:stats"))
+
+
 class DataTypeTests(APIAuthTestCase):
     def setUp(self):
         super(DataTypeTests, self).setUp()
@@ -635,6 +1504,68 @@ class ArchiveTests(APIAuthTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
 
+class CachingTests(APIAuthTestCase):
+    def setUp(self):
+        super(CachingTests, self).setUp()
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.archive = Archive.objects.create(
+            name="local", scheme="neurobank", root="/home/data/intracellular"
+        )
+        self.resource = Resource.objects.create(
+            dtype=self.dtype, created_by=self.user, metadata={}
+        )
+
+    def test_datatype_list_is_cached(self):
+        url = reverse("neurobank:datatype-list")
+        response = self.client.get(url)
+        self.assertEqual(len(response.data), 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.data[0]["name"], self.dtype.name)
+
+    def test_datatype_list_invalidated_on_save(self):
+        url = reverse("neurobank:datatype-list")
+        self.client.get(url)
+        DataType.objects.create(name="acoustic_waveform")
+        response = self.client.get(url)
+        self.assertEqual(len(response.data), 2)
+
+    def test_archive_list_invalidated_on_save_and_delete(self):
+        url = reverse("neurobank:archive-list")
+        self.client.get(url)
+        self.archive.accessibility = Archive.Accessibility.OFFLINE
+        self.archive.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]["accessibility"], "offline")
+        self.archive.delete()
+        response = self.client.get(url)
+        self.assertEqual(len(response.data), 0)
+
+    def test_resource_detail_query_count(self):
+        url = reverse("neurobank:resource", args=[self.resource.name])
+        self.client.get(url)
+        # conditional GET validators, the resource (joined to dtype and user), and
+        # its locations
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertEqual(response.data["dtype"], self.dtype.name)
+
+    def test_create_resource_validates_against_cache(self):
+        self.login()
+        response = self.client.post(
+            reverse("neurobank:resource-list"),
+            {"dtype": "no_such_dtype"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            reverse("neurobank:resource-list"),
+            {"dtype": self.dtype.name, "locations": [self.archive.name]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["dtype"], self.dtype.name)
+
+
 class ArchiveFilterTests(APIAuthTestCase):
     def setUp(self):
         super(ArchiveFilterTests, self).setUp()
@@ -740,6 +1671,415 @@ class ResourceFilterTests(APIAuthTestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]["name"], str(self.resource2))
 
+    def test_filter_on_indexed_metadata_key(self):
+        MetadataIndex.objects.create(dtype=self.dtype1, key="experimenter")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse("neurobank:resource-list"),
+                {"dtype": "spike", "metadata__experimenter": "dmeliza"},
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["name"] for r in response.data], [str(self.resource1)])
+        sql = [q["sql"] for q in ctx.captured_queries if "experimenter" in q["sql"]]
+        self.assertIn("-> 'experimenter'", sql[0])
+        self.assertIn(f'"dtype_id" = {self.dtype1.pk}', sql[0])
+
+    def test_indexed_metadata_key_filters_unchanged(self):
+        for depth in (100, 500, 1000, 2500.5, "1000", "600", True):
+            Resource.objects.create(
+                dtype=self.dtype1, created_by=self.user, metadata={"depth": depth}
+            )
+        url = reverse("neurobank:resource-list")
+        queries = [
+            {"metadata__depth": "500"},
+            {"metadata__depth": "1000"},
+            {"metadata__depth__gt": "500"},
+            {"metadata__depth__gte": "1000"},
+            {"metadata__depth__lt": "600"},
+            {"metadata__depth__lte": "1000"},
+        ]
+
+        def names(params):
+            response = self.client.get(url, {"dtype": self.dtype1.name, **params})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return sorted(r["name"] for r in response.data)
+
+        expected = [names(params) for params in queries]
+        self.assertTrue(any(expected))
+        MetadataIndex.objects.create(dtype=self.dtype1, key="depth")
+        self.assertEqual([names(params) for params in queries], expected)
+
+    def test_range_filter_on_indexed_metadata_key(self):
+        MetadataIndex.objects.create(dtype=self.dtype1, key="rec_date")
+        for date in ("2024-01-05", "2024-03-01"):
+            Resource.objects.create(
+                dtype=self.dtype1, created_by=self.user, metadata={"rec_date": date}
+            )
+        response = self.client.get(
+            reverse("neurobank:resource-list"),
+            {"dtype": self.dtype1.name, "metadata__rec_date__lt": "2024-02-01"},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["metadata"]["rec_date"], "2024-01-05")
+
+    def test_metadata_filter_not_rewritten_for_ambiguous_dtype(self):
+        MetadataIndex.objects.create(dtype=self.dtype1, key="experimenter")
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse("neurobank:resource-list"),
+                {"dtype": "_", "metadata__experimenter": "mcb2x"},
+            )
+        self.assertEqual([r["name"] for r in response.data], [str(self.resource2)])
+        sql = [q["sql"] for q in ctx.captured_queries if "experimenter" in q["sql"]]
+        self.assertNotIn(f'"dtype_id" = {self.dtype1.pk}', sql[0])
+
+    def test_can_search_metadata(self):
+        response = self.client.get(reverse("neurobank:resource-list"), {"q": "MCB2X"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r["name"] for r in response.data], [str(self.resource2)])
+        response = self.client.get(
+            reverse("neurobank:resource-list"), {"q": "mcb2x or dmeliza"}
+        )
+        self.assertEqual(len(response.data), 2)
+        response = self.client.get(
+            reverse("neurobank:resource-list"), {"q": "mcb2x -dmeliza"}
+        )
+        self.assertEqual([r["name"] for r in response.data], [str(self.resource2)])
+
+    def test_blank_search_is_ignored(self):
+        for q in (" ", "\t\n"):
+            response = self.client.get(reverse("neurobank:resource-list"), {"q": q})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                [r["name"] for r in response.data],
+                sorted(r["name"] for r in response.data),
+            )
+            self.assertEqual(len(response.data), Resource.objects.count())
+
+    def test_search_ranks_names_above_metadata(self):
+        named = Resource.objects.create(
+            name="hvc-unit", dtype=self.dtype1, created_by=self.user
+        )
+        mentioned = Resource.objects.create(
+            name="aaa-unit",
+            dtype=self.dtype1,
+            created_by=self.user,
+            metadata={"area": "HVC"},
+        )
+        response = self.client.get(reverse("neurobank:resource-list"), {"q": "hvc"})
+        self.assertEqual(
+            [r["name"] for r in response.data], [named.name, mentioned.name]
+        )
+
+    def test_search_sees_metadata_updates(self):
+        self.login()
+        self.client.patch(
+            reverse("neurobank:resource", args=[self.resource1.name]),
+            {"metadata": {"quality": "excellent"}},
+            format="json",
+        )
+        response = self.client.get(
+            reverse("neurobank:resource-list"), {"q": "excellent dmeliza"}
+        )
+        self.assertEqual([r["name"] for r in response.data], [str(self.resource1)])
+
+    def test_search_combines_with_filters(self):
+        response = self.client.get(
+            reverse("neurobank:resource-list"),
+            {"q": "dmeliza", "dtype": self.dtype2.name},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 0)
+
+
+class ShardTests(APIAuthTestCase):
+    def setUp(self):
+        super(ShardTests, self).setUp()
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.resources = [
+            Resource.objects.create(dtype=self.dtype, created_by=self.user)
+            for _ in range(10)
+        ]
+
+    def get_shard(self, shard, **params):
+        response = self.client.get(
+            reverse("neurobank:resource-list"), {"shard": shard, **params}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [r["name"] for r in response.data]
+
+    def test_shards_partition_resources(self):
+        for n in (1, 3, 4, 20):
+            shards = [self.get_shard(f"{k}/{n}") for k in range(n)]
+            names = [name for shard in shards for name in shard]
+            # shards are disjoint, ordered by id, and cover every resource
+            self.assertEqual(names, [r.name for r in self.resources])
+
+    def test_shards_combine_with_filters(self):
+        dtype = DataType.objects.create(name="other")
+        Resource.objects.filter(pk=self.resources[-1].pk).update(dtype=dtype)
+        names = self.get_shard("1/2", dtype=dtype.name)
+        self.assertEqual(names, [self.resources[-1].name])
+
+    def test_shards_with_fixed_range_are_stable(self):
+        lo, hi = self.resources[0].pk, self.resources[-1].pk
+        before = [self.get_shard(f"{k}/3:{lo}-{hi}") for k in range(3)]
+        self.resources[0].delete()
+        added = [
+            Resource.objects.create(dtype=self.dtype, created_by=self.user)
+            for _ in range(10)
+        ]
+        after = [self.get_shard(f"{k}/3:{lo}-{hi}") for k in range(3)]
+        self.assertEqual(after[0], before[0][1:])
+        self.assertEqual(after[1], before[1])
+        self.assertEqual(after[2], before[2] + [r.name for r in added])
+
+    def test_invalid_shard(self):
+        for shard in ("1", "a/b", "2/2", "-1/2", "0/0", "0/2:5", "0/2:9-5"):
+            response = self.client.get(
+                reverse("neurobank:resource-list"), {"shard": shard}
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch.object(views.ShardPagination, "page_size", 2)
+    def test_shard_keyset_pagination(self):
+        url = reverse("neurobank:resource-list") + "?shard=0/2"
+        names = []
+        with CaptureQueriesContext(connection) as queries:
+            while url:
+                response = self.client.get(url)
+                names.extend(r["name"] for r in response.data)
+                links = response.get("Link", "")
+                url = next(
+                    (
+                        link.split(";")[0].strip("<> ")
+                        for link in links.split(",")
+                        if 'rel="next"' in link
+                    ),
+                    None,
+                )
+        self.assertEqual(names, [r.name for r in self.resources[:5]])
+        self.assertFalse(any("OFFSET" in q["sql"] for q in queries))
+
+    @mock.patch.object(views.ShardPagination, "page_size", 2)
+    def test_shard_pages_keep_boundaries(self):
+        response = self.client.get(reverse("neurobank:resource-list"), {"shard": "0/2"})
+        names = [r["name"] for r in response.data]
+        lo, hi = self.resources[0].pk, self.resources[-1].pk
+        link = response["Link"]
+        self.assertIn(f"shard=0%2F2%3A{lo}-{hi}", link)
+        # new resources would move the boundary if it were recomputed
+        for _ in range(10):
+            Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        url = link.split(";")[0].strip("<> ")
+        while url:
+            response = self.client.get(url)
+            names.extend(r["name"] for r in response.data)
+            url = next(
+                (
+                    link.split(";")[0].strip("<> ")
+                    for link in response.get("Link", "").split(",")
+                    if 'rel="next"' in link
+                ),
+                None,
+            )
+        self.assertEqual(names, [r.name for r in self.resources[:5]])
+
+
+def slow_filter(qs, params):
+    # a filter that takes at least 50 ms to evaluate
+    return qs.filter(id__gte=RawSQL("(SELECT 0 FROM pg_sleep(0.05))", []))
+
+
+class QueryGuardTests(APIAuthTestCase):
+    def setUp(self):
+        super(QueryGuardTests, self).setUp()
+        self.dtype = DataType.objects.create(name="spike_times")
+        self.resource = Resource.objects.create(
+            dtype=self.dtype, created_by=self.user, metadata={"experimenter": "dmeliza"}
+        )
+
+    @mock.patch.object(guards, "statement_timeout", {"anonymous": 10})
+    def test_statement_timeout(self):
+        with (
+            mock.patch("nbank_registry.views.filter_metadata", slow_filter),
+            self.assertLogs("nbank_registry.guards", "WARNING") as logs,
+        ):
+            response = self.client.get(
+                reverse("neurobank:resource-list"), {"metadata__bird": "C42"}
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data["detail"].code, "query_timeout")
+        self.assertIn("metadata__bird", logs.output[0])
+        self.assertNotIn("C42", logs.output[0])
+
+    @mock.patch.object(guards, "statement_timeout", {"anonymous": 10})
+    def test_statement_timeout_depends_on_permission_level(self):
+        self.login()
+        with mock.patch("nbank_registry.views.filter_metadata", slow_filter):
+            response = self.client.get(reverse("neurobank:resource-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    @mock.patch.object(guards, "statement_timeout", 10)
+    def test_statement_timeout_in_bulk_stream(self):
+        with (
+            mock.patch.object(
+                Resource.objects,
+                "filter",
+                lambda *args, **kwargs: slow_filter(Resource.objects.all(), {}),
+            ),
+            self.assertLogs("nbank_registry.guards", "WARNING"),
+        ):
+            response = self.client.post(
+                reverse("neurobank:bulk-resource-list"),
+                {"names": [self.resource.name]},
+                format="json",
+            )
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @mock.patch.object(guards, "statement_timeout", 1000)
+    def test_bulk_stream_within_timeout(self):
+        response = self.client.post(
+            reverse("neurobank:bulk-resource-list"),
+            {"names": [self.resource.name]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        records = [json.loads(line) for line in response]
+        self.assertEqual([r["name"] for r in records], [self.resource.name])
+
+    @mock.patch.object(guards, "max_query_cost", {"anonymous": 0.01, "staff": None})
+    def test_expensive_query_rejected(self):
+        params = {"metadata__experimenter__icontains": "dmel"}
+        with self.assertLogs("nbank_registry.guards", "WARNING") as logs:
+            response = self.client.get(reverse("neurobank:resource-list"), params)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["detail"].code, "query_too_expensive")
+        self.assertIn("metadata__experimenter__icontains", logs.output[0])
+        # only queries with metadata filters or searches are checked
+        response = self.client.get(reverse("neurobank:resource-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.login()
+        response = self.client.get(reverse("neurobank:resource-list"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class BulkMetadataTests(APIAuthTestCase):
+    def setUp(self):
+        super(BulkMetadataTests, self).setUp()
+        self.dtype1 = DataType.objects.create(name="spike_times")
+        self.dtype2 = DataType.objects.create(name="acoustic_waveform")
+        self.resources = [
+            Resource.objects.create(
+                dtype=self.dtype1,
+                created_by=self.user,
+                metadata={"experimenter": "dmeliza", "unit": i},
+            )
+            for i in range(3)
+        ]
+        self.other = Resource.objects.create(
+            dtype=self.dtype2, created_by=self.user, metadata=None
+        )
+        self.url = reverse("neurobank:bulk-metadata-update")
+
+    def test_cannot_anonymously_update_metadata(self):
+        response = self.client.patch(
+            self.url,
+            {"names": [self.other.name], "metadata": {"quality": "good"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_can_update_metadata_by_name(self):
+        self.login()
+        names = [r.name for r in self.resources[:2]] + [self.other.name]
+        response = self.client.patch(
+            self.url,
+            {"names": names, "metadata": {"quality": "good", "unit": None}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 3)
+        for resource in Resource.objects.filter(name__in=names):
+            self.assertEqual(resource.metadata.get("quality"), "good")
+            self.assertNotIn("unit", resource.metadata)
+        self.resources[2].refresh_from_db()
+        self.assertEqual(
+            self.resources[2].metadata, {"experimenter": "dmeliza", "unit": 2}
+        )
+
+    def test_can_update_metadata_by_query(self):
+        self.login()
+        response = self.client.patch(
+            self.url + "?dtype=spike_times&metadata__experimenter=dmeliza",
+            {"metadata": {"quality": "good"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 3)
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other.metadata)
+
+    def test_bulk_metadata_update_bad_requests(self):
+        self.login()
+        response = self.client.patch(
+            self.url, {"metadata": {"quality": "good"}}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(
+            self.url, {"names": [self.other.name], "metadata": []}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for names in (self.other.name, [1, 2]):
+            response = self.client.patch(
+                self.url,
+                {"names": names, "metadata": {"quality": "good"}},
+                format="json",
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_metadata_update_needs_nonempty_selectors(self):
+        self.login()
+        for params in ("name=", "dtype=", "q=%20", "shard=", "name=&created_by="):
+            response = self.client.patch(
+                f"{self.url}?{params}", {"metadata": {"quality": "good"}}, format="json"
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+        self.assertFalse(Resource.objects.filter(metadata__has_key="quality").exists())
+
+    def test_bulk_metadata_update_records_each_resource_once(self):
+        self.login()
+        archives = [
+            Archive.objects.create(name=f"store_{i}", scheme="neurobank", root=f"/{i}")
+            for i in range(2)
+        ]
+        for archive in archives:
+            Location.objects.create(resource=self.resources[0], archive=archive)
+        response = self.client.patch(
+            self.url + "?location=store&metadata__experimenter=dmeliza",
+            {"metadata": {"experimenter": "mcb2x"}},
+            format="json",
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["updated"], 1)
+        changes = Change.objects.filter(action=Change.Action.RESOURCE_UPDATED)
+        self.assertEqual(
+            list(changes.values_list("resource_name", flat=True)),
+            [self.resources[0].name],
+        )
+        response = self.client.patch(
+            self.url + "?dtype=spike_times&metadata__experimenter=dmeliza",
+            {"metadata": {"experimenter": "mcb2x"}},
+            format="json",
+        )
+        self.assertEqual(response.data["updated"], 2)
+        self.assertEqual(
+            list(changes.values_list("resource_name", flat=True)[1:]),
+            sorted(r.name for r in self.resources[1:]),
+        )
+
 
 @override_settings(
     SENDFILE_BACKEND="django_sendfile.backends.nginx",
@@ -824,6 +2164,121 @@ class DownloadTests(APIAuthTestCase):
         data = [json.loads(record) for record in response]
         self.assertEqual(len(data), 2)
 
+    def test_bulk_locations_registry_location(self):
+        resources = [self.resource] + [
+            self._create_file(content=str(i).encode())[0] for i in range(3)
+        ]
+        query = {"names": [r.name for r in resources]}
+        url = reverse("neurobank:bulk-location-list")
+        # one query for all the locations, joined to resources and archives
+        with self.assertNumQueries(1):
+            response = self.client.post(url, query, format="json")
+            data = [json.loads(record) for record in response]
+        self.assertEqual(len(data), len(resources))
+        for record in data:
+            registry = record["locations"][-1]
+            self.assertEqual(registry["archive_name"], DOWNLOAD_ARCHIVE_NAME)
+            self.assertEqual(registry["resource_name"], record["name"])
+            self.assertEqual(registry["scheme"], "http")
+            self.assertEqual(
+                registry["root"],
+                "testserver" + reverse("neurobank:resource-download-base"),
+            )
+
+    def test_locations_best_prefers_local_archive(self):
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url, {"best": 1})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["archive_name"], self.archive.name)
+        resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        Location.objects.create(resource=resource, archive=self.archive)
+        remote = Archive.objects.create(
+            name="remote",
+            scheme="https",
+            root="example.org",
+            accessibility=Archive.Accessibility.REMOTE,
+        )
+        Location.objects.create(resource=resource, archive=remote)
+        url = reverse("neurobank:location-list", args=[resource])
+        response = self.client.get(url, {"best": 1})
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]["archive_name"], self.archive.name)
+
+    def test_locations_omit_registry_if_not_in_neurobank_archive(self):
+        # the registry can only serve files from neurobank archives
+        resource = Resource.objects.create(dtype=self.dtype, created_by=self.user)
+        url = reverse("neurobank:location-list", args=[resource])
+        response = self.client.get(url)
+        self.assertEqual(response.data, [])
+        url = reverse("neurobank:resource-download", args=[resource])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 415)
+
+    def test_locations_resolve_and_probe(self):
+        missing, _ = self._create_file(b"missing", skip_file_creation=True)
+        url = reverse("neurobank:location-list", args=[self.resource])
+        response = self.client.get(url, {"resolve": "probe"})
+        paths = {loc["archive_name"]: loc["path"] for loc in response.data}
+        self.assertTrue(ppath.samefile(paths[self.archive.name], self.fs_path))
+        download_url = response.wsgi_request.build_absolute_uri(
+            reverse("neurobank:resource-download", args=[self.resource])
+        )
+        self.assertEqual(paths[DOWNLOAD_ARCHIVE_NAME], download_url)
+
+        query = {"names": [self.resource.name, missing.name], "resolve": True}
+        response = self.client.post(
+            reverse("neurobank:bulk-location-list"), query, format="json"
+        )
+        data = {d["name"]: d["locations"] for d in map(json.loads, response)}
+        self.assertEqual(
+            data[missing.name][0]["path"],
+            ppath.join(
+                self.directory.name, "resources", missing.name[:2], missing.name
+            ),
+        )
+        query["resolve"] = "probe"
+        response = self.client.post(
+            reverse("neurobank:bulk-location-list"), query, format="json"
+        )
+        data = {d["name"]: d["locations"] for d in map(json.loads, response)}
+        self.assertIsNone(data[missing.name][0]["path"])
+        self.assertTrue(
+            ppath.samefile(data[self.resource.name][0]["path"], self.fs_path)
+        )
+
+    @mock.patch.object(resource_download, "probe_timeout", 0.05)
+    def test_locations_probe_skips_hung_archive(self):
+        names = [
+            self._create_file(bytes([i]), skip_file_creation=True)[0].name
+            for i in range(6)
+        ]
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        probed = []
+        resolve_extension = resource_download.resolve_extension
+
+        def probe(path):
+            probed.append(path)
+            hung.wait(5)
+            return resolve_extension(path)
+
+        query = {"names": names, "resolve": "probe"}
+        with (
+            mock.patch.object(resource_download, "resolve_extension", probe),
+            self.assertLogs("nbank_registry.resource_download", "WARNING"),
+        ):
+            response = self.client.post(
+                reverse("neurobank:bulk-location-list"), query, format="json"
+            )
+            data = [json.loads(record) for record in response]
+        self.assertEqual(len(data), len(names))
+        for record in data:
+            paths = {loc["archive_name"]: loc["path"] for loc in record["locations"]}
+            self.assertIsNone(paths[self.archive.name])
+        # probes stopped once the archive was marked unavailable
+        self.assertFalse(resource_download.archive_available(self.archive))
+        self.assertEqual(len(probed), resource_download.PROBE_WORKERS)
+
     def test_bulk_locations_filter_by_archive(self):
         archive = Archive.objects.create(
             name="other-local", scheme="neurobank", root=""
@@ -855,6 +2310,134 @@ class DownloadTests(APIAuthTestCase):
             )
         )
 
+    def _add_archive(self, name, accessibility=Archive.Accessibility.LOCAL):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        archive = Archive.objects.create(
+            name=name,
+            scheme="neurobank",
+            root=directory.name,
+            accessibility=accessibility,
+        )
+        path = resource_download.resource_path(archive.root, self.resource.name)
+        os.makedirs(path.parent)
+        path.write_bytes(b"")
+        Location.objects.create(resource=self.resource, archive=archive)
+        return archive, path
+
+    def test_download_prefers_accessible_archive(self):
+        Archive.objects.filter(pk=self.archive.pk).update(
+            accessibility=Archive.Accessibility.REMOTE
+        )
+        _, path = self._add_archive("fast")
+        url = reverse("neurobank:resource-download", args=[self.resource])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(ppath.samefile(response["X-Accel-Redirect"], path))
+
+    @mock.patch.object(resource_download, "probe_timeout", 0.05)
+    @mock.patch.object(resource_download, "max_failures", 2)
+    def test_download_skips_hung_archive(self):
+        backup, path = self._add_archive("backup", Archive.Accessibility.REMOTE)
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        probed = []
+        location_to_path = resource_download.location_to_path
+
+        def probe(location):
+            probed.append(location.archive.name)
+            if location.archive == self.archive:
+                hung.wait(5)
+            return location_to_path(location)
+
+        url = reverse("neurobank:resource-download", args=[self.resource])
+        with (
+            mock.patch.object(resource_download, "location_to_path", probe),
+            self.assertLogs("nbank_registry.resource_download", "WARNING"),
+        ):
+            for _ in range(3):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(ppath.samefile(response["X-Accel-Redirect"], path))
+            # the archive is skipped after two timeouts
+            self.assertEqual(probed.count(self.archive.name), 2)
+            self.assertEqual(probed.count(backup.name), 3)
+            Location.objects.filter(archive=backup).delete()
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertEqual(probed.count(self.archive.name), 2)
+
+    @mock.patch.object(resource_download, "probe_timeout", 0.05)
+    @mock.patch.object(resource_download, "max_failures", 100)
+    def test_hung_archive_does_not_starve_others(self):
+        backup, path = self._add_archive("backup", Archive.Accessibility.REMOTE)
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        location_to_path = resource_download.location_to_path
+
+        def probe(location):
+            if location.archive == self.archive:
+                hung.wait(5)
+            return location_to_path(location)
+
+        url = reverse("neurobank:resource-download", args=[self.resource])
+        with mock.patch.object(resource_download, "location_to_path", probe):
+            for _ in range(resource_download.PROBE_WORKERS + 8):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(ppath.samefile(response["X-Accel-Redirect"], path))
+        cache = caching.get_cache()
+        self.assertIsNone(cache.get(resource_download.archive_health_key(backup)))
+        # probes queued behind stuck workers are counted as failures
+        failures, _ = cache.get(resource_download.archive_health_key(self.archive))
+        self.assertEqual(failures, resource_download.PROBE_WORKERS + 8)
+
+    @mock.patch.object(resource_download, "probe_timeout", 0.05)
+    def test_hung_archive_opens_circuit_with_default_settings(self):
+        # there are fewer workers than the failures needed to open the circuit
+        self.assertLess(resource_download.PROBE_WORKERS, resource_download.max_failures)
+        backup, path = self._add_archive("backup", Archive.Accessibility.REMOTE)
+        hung = threading.Event()
+        self.addCleanup(hung.set)
+        location_to_path = resource_download.location_to_path
+
+        def probe(location):
+            if location.archive == self.archive:
+                hung.wait(5)
+            return location_to_path(location)
+
+        url = reverse("neurobank:resource-download", args=[self.resource])
+        with (
+            mock.patch.object(resource_download, "location_to_path", probe),
+            self.assertLogs("nbank_registry.resource_download", "WARNING"),
+        ):
+            for _ in range(resource_download.max_failures):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+        self.assertFalse(resource_download.archive_available(self.archive))
+        failures, _ = caching.get_cache().get(
+            resource_download.archive_health_key(self.archive)
+        )
+        self.assertEqual(failures, resource_download.max_failures)
+
+    def test_unavailable_archive_takes_priority_over_missing_file(self):
+        resource, _ = self._create_file(b"missing", skip_file_creation=True)
+        remote = Archive.objects.create(
+            name="remote",
+            scheme="neurobank",
+            root="/mnt/remote",
+            accessibility=Archive.Accessibility.REMOTE,
+        )
+        Location.objects.create(resource=resource, archive=remote)
+        caching.get_cache().set(
+            resource_download.archive_health_key(remote),
+            (resource_download.max_failures, time.time() + 60),
+        )
+        url = reverse("neurobank:resource-download", args=[resource])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 503)
+
     def test_missing_file(self):
         missing_resource, _ = self._create_file(b"missing", skip_file_creation=True)
         url = reverse("neurobank:resource-download", args=[missing_resource])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# -*- mode: python -*-
+"""Throttling for the bulk endpoints.
+
+A bulk request for a million names costs the database far more than one for
+ten, so bulk requests are throttled by the number of names rather than the
+number of requests. Each client has a token bucket holding up to the number of
+names allowed in one period, which refills continuously. A request is allowed
+if the bucket holds at least as many tokens as the request has names (requests
+larger than the bucket need a full bucket). Names streamed as
+`application/x-ndjson` can't be counted in advance, so streamed requests are
+allowed if the bucket isn't empty and are charged as the names are read, which
+can leave the bucket in debt.
+
+The rate is set by NEUROBANK_BULK_THROTTLE_RATE in DRF's `number/period`
+format (e.g. "1000000/hour"), either as a single rate or as a dict keyed by
+permission level ("anonymous", "authenticated", or "staff"). Buckets are kept
+in NEUROBANK_CACHE. Each update to a bucket holds a lock, taken with the
+cache's atomic `add`, so that concurrent requests from the same client can't
+all spend the same tokens. If the lock can't be taken within LOCK_WAIT
+seconds, the request is throttled. Requests that are rejected as invalid after
+being charged can be refunded.
+
+"""
+
+import contextlib
+import time
+
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from nbank_registry import caching
+from nbank_registry.guards import limit_for
+from nbank_registry.parsers import NameStream
+
+rate = getattr(settings, "NEUROBANK_BULK_THROTTLE_RATE", None)
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# how long to wait for another request to release a bucket, in seconds
+LOCK_WAIT = 1.0
+# how long a lock is held before it expires (e.g. if its worker died)
+LOCK_TIMEOUT = 5
+
+
+def parse_rate(rate):
+    """Returns (number of names, period in seconds) for a rate string"""
+    num, period = rate.split("/")
+    return int(num), PERIODS[period[0]]
+
+
+def request_names(request):
+    names = request.data.get("names") if isinstance(request.data, dict) else None
+    return names if isinstance(names, list) else []
+
+
+def is_streamed(request):
+    return isinstance(request.data, NameStream)
+
+
+class BulkNameThrottle(BaseThrottle):
+    """Token bucket throttle where each name in the request costs one token"""
+
+    cache_format = "nbank_registry:bulk-throttle:{}"
+    timer = time.time
+
+    def __init__(self):
+        self._wait = None
+
+    def get_cache_key(self, request):
+        if request.user is not None and request.user.is_authenticated:
+            ident = f"user-{request.user.pk}"
+        else:
+            ident = f"addr-{self.get_ident(request)}"
+        return self.cache_format.format(ident)
+
+    @contextlib.contextmanager
+    def locked(self, key):
+        """Holds the lock on a bucket. Yields False if it can't be taken in time."""
+        cache = caching.get_cache()
+        lock = f"{key}:lock"
+        deadline = time.monotonic() + LOCK_WAIT
+        while not (acquired := cache.add(lock, True, LOCK_TIMEOUT)):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.005)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cache.delete(lock)
+
+    def take(self, request, cost, required=None):
+        """Takes cost tokens from the client's bucket if it has at least required.
+
+        If required is None, cost is limited to the capacity of the bucket and
+        required is the same as cost. A negative cost returns tokens to the
+        bucket. Returns the number of seconds to wait if there aren't enough
+        tokens, and None otherwise.
+
+        """
+        user_rate = limit_for(rate, request.user)
+        if user_rate is None:
+            return None
+        capacity, period = parse_rate(user_rate)
+        refill = capacity / period
+        if required is None:
+            cost = required = min(cost, capacity)
+        key = self.get_cache_key(request)
+        cache = caching.get_cache()
+        with self.locked(key) as acquired:
+            if not acquired:
+                return LOCK_WAIT
+            entry = cache.get(key)
+            now = self.timer()
+            tokens, updated = entry or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated) * refill)
+            if tokens < required:
+                return (required - tokens) / refill
+            # debt is limited to one period's worth of names, so the bucket is
+            # full again (the same as a missing entry) within two periods
+            tokens = min(capacity, max(tokens - cost, -capacity))
+            cache.set(key, (tokens, now), 2 * period)
+        request._nbank_bulk_charge = getattr(request, "_nbank_bulk_charge", 0) + cost
+        return None
+
+    def charge(self, request, cost):
+        """Takes cost tokens from the client's bucket, even if it goes into debt"""
+        self.take(request, cost, required=0)
+
+    def allow_request(self, request, view):
+        if is_streamed(request):
+            self._wait = self.take(request, 0, required=1)
+        else:
+            self._wait = self.take(request, len(request_names(request)))
+        return self._wait is None
+
+    def wait(self):
+        return self._wait
+
+
+def refund(request):
+    """Returns the tokens charged to a request that was rejected as invalid"""
+    cost = getattr(request, "_nbank_bulk_charge", 0)
+    if cost:
+        BulkNameThrottle().take(request, -cost, required=0)
+        request._nbank_bulk_charge = 0
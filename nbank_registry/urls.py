@@ -47,6 +47,13 @@ urlpatterns = [
         views.bulk_location_list,
         name="bulk-location-list",
     ),
+    path(
+        "bulk/metadata/",
+        views.BulkMetadataUpdate.as_view(),
+        name="bulk-metadata-update",
+    ),
+    path("changes/", views.change_list, name="change-list"),
+    path("stats/", views.registry_stats, name="stats"),
     path(
         "download/<slug:name>/",
         views.download_resource,
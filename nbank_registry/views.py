@@ -1,32 +1,132 @@
 # -*- coding: utf-8 -*-
 # -*- mode: python -*-
+import bisect
+import hashlib
 import itertools
+import re
 from urllib.parse import urlparse
 
-from django.db.models import Q
+from django.conf import settings
+from django.core.validators import EMPTY_VALUES
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Collate, Greatest
 from django.db.utils import IntegrityError
-from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django_filters import rest_framework as filters
 from django_sendfile import sendfile
 from drf_link_header_pagination import LinkHeaderPagination
-from rest_framework import generics, permissions, status
-from rest_framework.decorators import api_view
-from rest_framework.renderers import JSONRenderer
+from rest_framework import generics, pagination, permissions, status
+from rest_framework.decorators import (
+    api_view,
+    parser_classes,
+    renderer_classes,
+    throttle_classes,
+)
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from rest_framework.utils.urls import replace_query_param
 
 from nbank_registry import (
     __version__,
     api_version,
+    caching,
     errors,
+    guards,
     models,
+    parsers,
+    renderers,
     resource_download,
+    search,
     serializers,
+    stats,
+    streaming,
+    throttling,
 )
+from nbank_registry.expressions import metadata_patch
 
 DOWNLOAD_ARCHIVE_NAME = "registry"
 
+# the maximum number of names in a bulk request
+bulk_max_names = getattr(settings, "NEUROBANK_BULK_MAX_NAMES", 100000)
+# the number of names looked up in each query by the bulk endpoints
+bulk_chunk_size = getattr(settings, "NEUROBANK_BULK_CHUNK_SIZE", 1000)
+
+
+def registry_archive(request):
+    """Returns a virtual (non-persisted) Archive for the registry's download endpoint.
+
+    The archive depends only on the host and scheme of the request, so it's
+    constructed once per request and stored on the request object.
+
+    """
+    try:
+        return request._nbank_registry_archive
+    except AttributeError:
+        base = reverse("neurobank:resource-download-base")
+        url = urlparse(request.build_absolute_uri(base))
+        archive = models.Archive(
+            name=DOWNLOAD_ARCHIVE_NAME,
+            scheme=request.scheme,
+            root=f"{url.netloc}{url.path}",
+            accessibility=models.Archive.Accessibility.REMOTE,
+        )
+        request._nbank_registry_archive = archive
+        return archive
+
+
+def registry_location_template(request):
+    """Returns the serialized virtual registry location, with a blank resource_name.
+
+    Streaming views can fill in the resource name for each record rather than
+    constructing and serializing new objects.
+
+    """
+    location = models.Location(
+        archive=registry_archive(request), resource=models.Resource(name="")
+    )
+    return serializers.LocationSerializer(location).data
+
+
+def location_resolver(option):
+    """Returns a function that adds the full path or URL to a serialized location.
+
+    `option` is the value of the `resolve` parameter. Returns None if it's
+    false or missing. If it's "probe", neurobank paths are checked on the
+    filesystem, using the same worker threads and archive health as downloads,
+    so the path is null for archives that are unavailable. The virtual registry
+    location resolves to the resource's download URL; other locations are
+    resolved by resource_download.location_url.
+
+    """
+    if option != "probe" and not is_true(option):
+        return None
+    probe = option == "probe"
+    archives = caching.archive_index()["name"]
+
+    def resolve(location):
+        if location["archive_name"] == DOWNLOAD_ARCHIVE_NAME:
+            path = (
+                f"{location['scheme']}://{location['root']}{location['resource_name']}/"
+            )
+        else:
+            try:
+                archive = archives[location["archive_name"]]
+            except KeyError:
+                archive = models.Archive.objects.get(name=location["archive_name"])
+            path = resource_download.location_url(
+                archive, location["resource_name"], probe=probe
+            )
+        location["path"] = path
+        return location
+
+    return resolve
+
 
 def add_virtual_registry_location(request, resource, qs):
     """Add a virtual (non-persisted) location for registry downloads.
@@ -37,18 +137,73 @@ def add_virtual_registry_location(request, resource, qs):
     deferred until the user tries to retrieve it.
 
     """
-    base = reverse("neurobank:resource-download-base")
-    url = urlparse(request.build_absolute_uri(base))
-    registry_archive = models.Archive(
-        name=DOWNLOAD_ARCHIVE_NAME,
-        scheme=request.scheme,
-        root=f"{url.netloc}{url.path}",
-        accessibility=models.Archive.Accessibility.REMOTE,
+    registry_location = models.Location(
+        archive=registry_archive(request), resource=resource
     )
-    registry_location = models.Location(archive=registry_archive, resource=resource)
     return itertools.chain(qs, [registry_location])
 
 
+def resource_validators(request, name):
+    """Returns (last modified, number of locations) for the named resource, or None.
+
+    The last modified time is the latest of the modification times of the
+    resource, its dtype, and the archives it's in, because changes to any of
+    them can change the response. This is a single indexed query that's much
+    cheaper than serializing the resource. The result is stored on the request
+    so that the ETag and Last-Modified functions only hit the database once.
+
+    """
+    try:
+        return request._nbank_resource_validators
+    except AttributeError:
+        validators = (
+            models.Resource.objects.filter(name=name)
+            .annotate(
+                last_modified=Greatest(
+                    "modified_on",
+                    "dtype__modified_on",
+                    Max("location__archive__modified_on"),
+                ),
+                n_locations=Count("location"),
+            )
+            .values_list("last_modified", "n_locations")
+            .first()
+        )
+        request._nbank_resource_validators = validators
+        return validators
+
+
+def resource_etag(request, *args, **kwargs):
+    """Returns an ETag for the resource and the requested representation"""
+    name = kwargs.get("name", kwargs.get("resource_name"))
+    if (validators := resource_validators(request, name)) is not None:
+        modified_on, n_locations = validators
+        # the format (from Accept or ?format) and options like ?resolve also
+        # change the response body
+        representation = "{} {}".format(
+            request.META.get("HTTP_ACCEPT", ""),
+            sorted(request.GET.lists()),
+        )
+        digest = hashlib.sha1(representation.encode()).hexdigest()[:16]
+        return f"{modified_on.timestamp():.6f}-{n_locations}-{digest}"
+
+
+def resource_last_modified(request, *args, **kwargs):
+    name = kwargs.get("name", kwargs.get("resource_name"))
+    if (validators := resource_validators(request, name)) is not None:
+        return validators[0]
+
+
+# answers conditional GETs with 304 Not Modified without serializing the resource
+resource_conditional_get = method_decorator(
+    [
+        vary_on_headers("Accept"),
+        condition(etag_func=resource_etag, last_modified_func=resource_last_modified),
+    ],
+    name="get",
+)
+
+
 @api_view(["GET"])
 def api_root(request, format=None):
     return Response(
@@ -63,6 +218,8 @@ def api_root(request, format=None):
             "archives": reverse(
                 "neurobank:archive-list", request=request, format=format
             ),
+            "changes": reverse("neurobank:change-list", request=request, format=format),
+            "stats": reverse("neurobank:stats", request=request, format=format),
         }
     )
 
@@ -79,6 +236,19 @@ def api_info(request):
     )
 
 
+@api_view(["GET"])
+@renderer_classes(renderers.DEFAULT_RENDERER_CLASSES)
+def registry_stats(request, format=None):
+    """Counts of resources in the registry, in total and by dtype, creator, and
+    month created, and counts of locations by archive.
+
+    The counts are maintained as resources and locations are added and removed,
+    so this is fast no matter how large the registry is.
+
+    """
+    return Response(stats.summary())
+
+
 class ArchiveFilter(filters.FilterSet):
     name = filters.CharFilter(field_name="name", lookup_expr="istartswith")
     scheme = filters.CharFilter(field_name="scheme", lookup_expr="istartswith")
@@ -109,6 +279,31 @@ class ResourceFilter(filters.FilterSet):
     scheme = filters.CharFilter(
         field_name="locations__scheme", lookup_expr="istartswith"
     )
+    q = filters.CharFilter(method="filter_search", label="Search names and metadata")
+    shard = filters.CharFilter(
+        method="filter_shard", label="Partition k/n of the resources by id"
+    )
+
+    def filter_search(self, queryset, name, value):
+        return search.search_resources(queryset, value)
+
+    def filter_shard(self, queryset, name, value):
+        match = SHARD_RE.match(value)
+        if match is not None:
+            k, n, lo, hi = (None if g is None else int(g) for g in match.groups())
+        if match is None or not 0 <= k < n or (lo is not None and lo > hi):
+            raise ValidationError(
+                {"shard": "must be k/n or k/n:lo-hi, with 0 <= k < n and lo <= hi"}
+            )
+        if lo is None:
+            span = models.Resource.objects.aggregate(lo=Min("id"), hi=Max("id"))
+            lo, hi = span["lo"], span["hi"]
+            if lo is None:
+                return queryset
+        if self.request is not None:
+            # later pages use the same boundaries (see ShardPagination)
+            self.request._nbank_shard = f"{k}/{n}:{lo}-{hi}"
+        return queryset.filter(**shard_bounds(k, n, lo, hi))
 
     class Meta:
         model = models.Resource
@@ -117,6 +312,122 @@ class ResourceFilter(filters.FilterSet):
         }
 
 
+# k/n, optionally followed by the range of ids to partition as :lo-hi
+SHARD_RE = re.compile(r"^(\d+)/(\d+)(?::(\d+)-(\d+))?$")
+
+
+def shard_bounds(k, n, lo, hi):
+    """Returns lookups selecting the kth of n ranges spanning the ids from lo to hi.
+
+    The first and last ranges are open-ended, so every resource is in exactly
+    one shard for a given n, lo, and hi.
+
+    """
+    span = hi - lo + 1
+    lookups = {}
+    if k > 0:
+        lookups["id__gte"] = lo + span * k // n
+    if k < n - 1:
+        lookups["id__lt"] = lo + span * (k + 1) // n
+    return lookups
+
+
+class ShardPagination(pagination.CursorPagination):
+    """Keyset pagination by id, with links in the Link header.
+
+    Used for sharded listings so that each page is an index range scan
+    instead of an OFFSET. The links pin the range of ids that the shard
+    boundaries were computed from, so that resources created or deleted
+    during a crawl don't move the boundaries between pages.
+
+    """
+
+    ordering = "id"
+
+    def encode_cursor(self, cursor):
+        url = super().encode_cursor(cursor)
+        if shard := getattr(self.request, "_nbank_shard", None):
+            url = replace_query_param(url, "shard", shard)
+        return url
+
+    def get_paginated_response(self, data):
+        links = [
+            '<{}>; rel="{}"'.format(url, label)
+            for url, label in (
+                (self.get_previous_link(), "prev"),
+                (self.get_next_link(), "next"),
+            )
+            if url is not None
+        ]
+        headers = {"Link": ", ".join(links)} if links else {}
+        return Response(data, headers=headers)
+
+
+def has_designed_filters(params):
+    """True if params include metadata filters or a search"""
+    return bool(params.get("q", "").strip()) or any(
+        k.startswith("metadata__") for k in params
+    )
+
+
+# lookups on metadata keys that can use the expression indexes
+INDEXED_METADATA_LOOKUPS = ("exact", "gt", "gte", "lt", "lte")
+
+
+def indexed_metadata_keys(dtype_param):
+    """Returns (dtype pk, indexed keys) if dtype_param selects a single dtype.
+
+    dtype_param is matched the same way as the dtype filter (case-insensitive
+    substring). Returns (None, ()) if it matches no dtype or more than one.
+
+    """
+    if not dtype_param:
+        return None, ()
+    configured = caching.metadata_index_keys()
+    if not configured:
+        return None, ()
+    matches = [
+        dtype
+        for name, dtype in caching.datatype_index()["name"].items()
+        if dtype_param.lower() in name.lower()
+    ]
+    if len(matches) != 1:
+        return None, ()
+    return matches[0].pk, configured.get(matches[0].pk, ())
+
+
+def filter_metadata(qs, params):
+    """Filter resources using query params that start with `metadata__`.
+
+    A `__neq` suffix turns the filter into an exclusion. If the `dtype` param
+    selects a single dtype and a filter is on one of its indexed metadata keys,
+    the dtype is also selected by id so that the partial index for the key can
+    be used.
+
+    """
+    # this could be a little dangerous b/c we're letting the user design
+    # queries
+    mf = {}
+    me = {}
+    uses_index = False
+    dtype_id, indexed_keys = indexed_metadata_keys(params.get("dtype"))
+    for k, v in params.items():
+        if k.startswith("metadata__"):
+            key, _, lookup = k[10:].partition("__")
+            if k.endswith("__neq"):
+                me[k[:-5]] = v
+            else:
+                mf[k] = v
+                uses_index |= (
+                    key in indexed_keys
+                    and (lookup or "exact") in INDEXED_METADATA_LOOKUPS
+                )
+    qs = qs.exclude(**me).filter(**mf)
+    if uses_index:
+        qs = qs.filter(dtype_id=dtype_id)
+    return qs
+
+
 class ResourceList(generics.ListCreateAPIView):
     """This view is a list of resources in the registry.
 
@@ -131,10 +442,22 @@ class ResourceList(generics.ListCreateAPIView):
     `?metadata__experimenter__isnull=True` will return all resources without a
     value set for `experimenter`.
 
+    Use `?q=` to search resource names and metadata values. Results are
+    ordered by relevance. The query can use web search syntax, e.g.
+    `?q=HVC "good isolation" -noisy`.
+
+    Use `?shard=k/n` to retrieve the kth of n disjoint partitions of the
+    results (counting from 0), so that n clients can list the registry in
+    parallel. Shards are ranges of resource ids and are ordered by id. The
+    boundaries divide the ids from the lowest to the highest in the registry,
+    unless the range is given as `?shard=k/n:lo-hi`; clients that start at
+    different times should use the same range.
+
     """
 
-    queryset = models.Resource.objects.all()
+    queryset = models.Resource.objects.select_related("created_by")
     serializer_class = serializers.ResourceSerializer
+    renderer_classes = renderers.with_msgpack(renderers.DEFAULT_RENDERER_CLASSES)
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = ResourceFilter
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
@@ -142,28 +465,47 @@ class ResourceList(generics.ListCreateAPIView):
 
     def filter_queryset(self, queryset):
         qs = super(ResourceList, self).filter_queryset(queryset)
-        # this could be a little dangerous b/c we're letting the user design
-        # queries
-        mf = {}
-        me = {}
-        for k, v in self.request.GET.items():
-            if k.startswith("metadata__"):
-                if k.endswith("__neq"):
-                    me[k[:-5]] = v
-                else:
-                    mf[k] = v
-        return qs.exclude(**me).filter(**mf).order_by("name")
+        qs = filter_metadata(qs, self.request.GET)
+        if has_designed_filters(self.request.GET):
+            guards.check_query_cost(self.request, qs)
+        if self.request.GET.get("shard"):
+            return qs.order_by("id")
+        # the search filter is skipped (and doesn't add a rank) for a blank query
+        if "rank" in qs.query.annotations:
+            return qs.order_by("-rank", "name")
+        return qs.order_by("name")
+
+    @property
+    def paginator(self):
+        if not hasattr(self, "_paginator"):
+            if self.request.GET.get("shard"):
+                self._paginator = ShardPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def list(self, request, *args, **kwargs):
+        with guards.timeout_guard(request):
+            return super().list(request, *args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
 
 
+@resource_conditional_get
 class ResourceDetail(generics.RetrieveUpdateDestroyAPIView):
     lookup_field = "name"
-    queryset = models.Resource.objects.all()
+    queryset = models.Resource.objects.select_related("created_by")
     serializer_class = serializers.ResourceSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        models.Change.lock_log()
+        models.Change.record(models.Change.Action.RESOURCE_DELETED, instance)
+        instance.delete()
+
 
 @api_view(["GET"])
 def download_resource(request, name):
@@ -172,6 +514,12 @@ def download_resource(request, name):
         path = resource_download.local_resource_path(resource)
     except models.Resource.DoesNotExist:
         return Response({"detail": "not found"}, status=status.HTTP_404_NOT_FOUND)
+    except errors.ArchiveUnavailableError as err:
+        return Response(
+            {"detail": str(err)},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(resource_download.retry_seconds)},
+        )
     except errors.NotAvailableForDownloadError as err:
         return Response(
             {"detail": str(err)}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
@@ -179,10 +527,37 @@ def download_resource(request, name):
     return sendfile(request, path, attachment=True)
 
 
-class ArchiveList(generics.ListCreateAPIView):
+class CachedListMixin:
+    """Serves unfiltered, unpaginated list requests from the cache.
+
+    The cached entry under `list_cache_key` must be invalidated when the
+    underlying table changes (see nbank_registry.signals). Like the other
+    cache entries, it is filled from the default database.
+
+    """
+
+    list_cache_key = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        data = caching.get_or_set(
+            self.list_cache_key,
+            lambda: list(
+                self.get_serializer(
+                    self.get_queryset().using(caching.PRIMARY), many=True
+                ).data
+            ),
+        )
+        return Response(data)
+
+
+class ArchiveList(CachedListMixin, generics.ListCreateAPIView):
+    list_cache_key = caching.ARCHIVE_LIST_KEY
     lookup_field = "name"
     queryset = models.Archive.objects.all()
     serializer_class = serializers.ArchiveSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = ArchiveFilter
@@ -192,13 +567,16 @@ class ArchiveDetail(generics.RetrieveUpdateAPIView):
     lookup_field = "name"
     queryset = models.Archive.objects.all()
     serializer_class = serializers.ArchiveSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
 
-class DataTypeList(generics.ListCreateAPIView):
+class DataTypeList(CachedListMixin, generics.ListCreateAPIView):
+    list_cache_key = caching.DATATYPE_LIST_KEY
     lookup_field = "name"
     queryset = models.DataType.objects.all()
     serializer_class = serializers.DataTypeSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
 
@@ -206,34 +584,64 @@ class DataTypeDetail(generics.RetrieveAPIView):
     lookup_field = "name"
     queryset = models.DataType.objects.all()
     serializer_class = serializers.DataTypeSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
 
+@resource_conditional_get
 class LocationList(generics.ListAPIView):
-    """List locations for a specific resource"""
+    """List locations for a specific resource, most accessible first.
+
+    Use `?best=1` to return only the most accessible location. Use `?resolve=1`
+    to include the full path or URL of each location, or `?resolve=probe` to
+    also check that neurobank paths exist and resolve their extensions (`path`
+    is null if the file can't be found or the archive is unavailable).
+
+    """
 
     serializer_class = serializers.LocationSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
     filter_backends = (filters.DjangoFilterBackend,)
     filterset_class = LocationFilter
 
     def get_object(self):
-        return get_object_or_404(models.Resource, name=self.kwargs["resource_name"])
+        return get_object_or_404(
+            models.Resource.objects,
+            name=self.kwargs["resource_name"],
+        )
 
     def get_queryset(self):
-        resource = self.get_object()
-        return resource.location_set.all()
+        # this needs to be lazy, because permission checks call it before the
+        # conditional GET handler can return 304 Not Modified
+        return (
+            models.Location.objects.filter(resource__name=self.kwargs["resource_name"])
+            .select_related("archive", "resource")
+            .order_by("archive__accessibility")
+        )
 
     def list(self, request, *args, **kwargs):
-        resource = self.get_object()
-        f = LocationFilter(
-            request.GET, resource.location_set.order_by("archive__accessibility")
-        )
-        qs = f.qs
-        if resource.dtype.downloadable and len(request.query_params) == 0:
-            qs = add_virtual_registry_location(request, resource, qs)
-        serializer = self.get_serializer(qs, many=True)
-        return Response(serializer.data)
+        # resource and archives all come from one joined query; the
+        # resource only has to be looked up separately if there are no locations
+        best = is_true(request.query_params.get("best", False))
+        qs = self.filter_queryset(self.get_queryset())
+        locations = list(qs[:1] if best else qs)
+        if locations:
+            resource = locations[0].resource
+        else:
+            resource = self.get_object()
+        if resource.downloadable and not location_filters_applied(request.query_params):
+            locations = list(
+                add_virtual_registry_location(request, resource, locations)
+            )
+        if best:
+            locations = locations[:1]
+        data = self.get_serializer(locations, many=True).data
+        if (
+            resolver := location_resolver(request.query_params.get("resolve"))
+        ) is not None:
+            data = [resolver(loc) for loc in data]
+        return Response(data)
 
     def post(self, request, *args, **kwargs):
         data = {
@@ -254,6 +662,7 @@ class LocationList(generics.ListAPIView):
 class LocationDetail(generics.RetrieveDestroyAPIView):
     queryset = models.Location.objects.all()
     serializer_class = serializers.LocationSerializer
+    renderer_classes = renderers.DEFAULT_RENDERER_CLASSES
     permission_classes = (permissions.DjangoModelPermissionsOrAnonReadOnly,)
 
     def get_object(self):
@@ -263,8 +672,42 @@ class LocationDetail(generics.RetrieveDestroyAPIView):
             archive__name=self.kwargs["archive_pk"],
         )
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        models.Change.lock_log()
+        models.Change.record(
+            models.Change.Action.LOCATION_REMOVED, instance.resource, instance.archive
+        )
+        instance.delete()
+
+
+def is_true(value):
+    """Interprets a query param or JSON value as a boolean flag"""
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes", "on")
+    return bool(value)
+
+
+def location_filters_applied(params):
+    return any(key in LocationFilter.base_filters for key in params)
+
 
 def check_bulk_args(request):
+    """Returns an error response if the body of a bulk request is invalid.
+
+    The throttle has already charged the request for its names by this point,
+    so invalid requests are refunded.
+
+    """
+    if (response := bulk_args_error(request)) is not None:
+        throttling.refund(request)
+    return response
+
+
+def bulk_args_error(request):
+    if isinstance(request.data, parsers.NameStream):
+        # streamed names are checked as they are read
+        return None
     try:
         names = request.data["names"]
     except KeyError:
@@ -272,67 +715,343 @@ def check_bulk_args(request):
             {"detail": "usage: {'names': ['id1', 'id2', ...]}"},
             status=status.HTTP_400_BAD_REQUEST,
         )
+    if not isinstance(names, list):
+        return Response(
+            {"detail": "names must be a list"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
     if len(names) == 0:
         return Response(
             {"detail": "must supply at least one name"},
             status=status.HTTP_400_BAD_REQUEST,
         )
+    if bulk_max_names and len(names) > bulk_max_names:
+        return Response(
+            {"detail": f"too many names (maximum is {bulk_max_names})"},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        )
+    if not isinstance(request.data.get("after", ""), str):
+        return Response(
+            {"detail": "after must be a resource name"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+
+def name_chunks(names, after=None):
+    """Yields the distinct names in sorted order, in chunks of bulk_chunk_size.
+
+    If after is not None, only names that sort after it are included. Names are
+    compared by code point, which matches the "C" collation used by name_order.
+
+    """
+    names = sorted({str(name) for name in names})
+    if after is not None:
+        names = names[bisect.bisect_right(names, after) :]
+    for i in range(0, len(names), bulk_chunk_size):
+        yield names[i : i + bulk_chunk_size]
+
+
+def streamed_name_chunks(request, names, after=None):
+    """Yields chunks of names from a NameStream as they are read.
+
+    Each chunk is deduplicated and sorted, so the records are only in name
+    order overall if the client sends the names in order. Resuming a stream
+    relies on that order, so if after is not None, the whole stream is read
+    (up to bulk_max_names) and sorted before the first chunk is yielded. Each
+    chunk is charged to the client's bulk throttle as it is read. Raises
+    TooManyNamesError if the stream has more than bulk_max_names names.
+
+    """
+    throttle = throttling.BulkNameThrottle()
+
+    def read():
+        count = 0
+        for chunk in names.chunks(bulk_chunk_size):
+            count += len(chunk)
+            if bulk_max_names and count > bulk_max_names:
+                raise errors.TooManyNamesError(
+                    f"too many names (maximum is {bulk_max_names})"
+                )
+            throttle.charge(request, len(chunk))
+            yield chunk
+
+    if after is not None:
+        yield from name_chunks(list(itertools.chain.from_iterable(read())), after)
+        return
+    for chunk in read():
+        yield sorted(set(chunk))
+
+
+def bulk_params(request):
+    """Returns the names and the options for a bulk request.
+
+    Names can be posted in a JSON object along with the options, or streamed
+    as `application/x-ndjson` (one JSON string per line) with the options in
+    the query string.
+
+    """
+    if isinstance(request.data, parsers.NameStream):
+        return request.data, request.query_params
+    return request.data["names"], request.data
 
 
-class JSONLRenderer(JSONRenderer):
-    def render(self, data, accepted_media_type=None, renderer_context=None):
-        out = super().render(data, accepted_media_type=None, renderer_context=None)
-        return out + b"\n"
+def bulk_name_chunks(request, names, after=None):
+    if isinstance(names, parsers.NameStream):
+        return streamed_name_chunks(request, names, after)
+    return name_chunks(names, after)
+
+
+def name_order(field):
+    """Orders by a name field in code point order, independent of the database locale"""
+    return Collate(field, "C")
+
+
+def bulk_stream(records, renderer, after=None):
+    """Renders records, a sequence of (name, data) pairs in name order.
+
+    If after is not None, the stream ends with a trailer record giving the last
+    name delivered and the number of records, so that the client can tell the
+    stream is complete. An interrupted stream can be resumed by repeating the
+    request with `after` set to the last name received.
+
+    """
+    last, count = after, 0
+    for name, data in records:
+        yield renderer.render(data)
+        last, count = name, count + 1
+    if after is not None:
+        yield renderer.render({"trailer": {"last": last, "count": count}})
 
 
 @api_view(["POST"])
+@renderer_classes(renderers.STREAM_RENDERER_CLASSES)
+@parser_classes(parsers.BULK_PARSER_CLASSES)
+@throttle_classes([throttling.BulkNameThrottle])
 def bulk_resource_list(request, format=None):
     """Retrieve metadata for multiple resources by name. POST {'names': ['name1', 'name2',...]}.
-    Streams results as line-delimited JSON records.
+    Streams results as line-delimited JSON records, or as length-prefixed
+    MessagePack records with `Accept: application/x-msgpack`, ordered by name.
+
+    Set `'after': '<name>'` to skip names up to and including `<name>` and end
+    the stream with a `{'trailer': {'last': <name>, 'count': <n>}}` record.
+    Use `'after': ''` to get the trailer for a complete request.
+
+    Names can also be sent with `Content-Type: application/x-ndjson`, one JSON
+    string per line, and options in the query string (e.g. `?after=`). The
+    names are read and looked up in chunks, so records are sent while the
+    request is still being read, and are sorted within each chunk. With
+    `after`, the names are all read and sorted before the first record is sent,
+    so that the stream can be resumed.
 
     """
     if (resp := check_bulk_args(request)) is not None:
         return resp
-    query = Q()
-    for name in request.data["names"]:
-        query |= Q(name=name)
-    qs = models.Resource.objects.filter(query)
-    renderer = JSONLRenderer()
-    gen = (renderer.render(serializers.ResourceSerializer(obj).data) for obj in qs)
-
-    return StreamingHttpResponse(gen)
+    names, options = bulk_params(request)
+    after = options.get("after")
+    renderer = renderers.record_renderer(request)
+
+    def gen(names):
+        # each chunk is a separate query to keep the IN list and the number
+        # of objects in memory bounded
+        for chunk in bulk_name_chunks(request, names, after):
+            qs = (
+                models.Resource.objects.filter(name__in=chunk)
+                .select_related("created_by")
+                .prefetch_related("locations")
+                .order_by(name_order("name"))
+            )
+            for obj in qs:
+                yield obj.name, serializers.ResourceSerializer(obj).data
+
+    chunks = bulk_stream(gen(names), renderer, after)
+    return streaming.streaming_response(
+        request,
+        guards.guarded_stream(request, chunks),
+        content_type=renderer.media_type,
+    )
 
 
 @api_view(["POST"])
+@renderer_classes(renderers.STREAM_RENDERER_CLASSES)
+@parser_classes(parsers.BULK_PARSER_CLASSES)
+@throttle_classes([throttling.BulkNameThrottle])
 def bulk_location_list(request, format=None):
     """Retrieve locations for multiple resources by name. POST {'names': ['name1', 'name2',...]}
-    Streams results as line-delimited JSON records.
+    Streams results as line-delimited JSON records (or length-prefixed
+    MessagePack records with `Accept: application/x-msgpack`), ordered by name.
+
+    Locations can be filtered by archive name or scheme (e.g. `'archive': 'local'`).
+    Set `'best': true` to return only the most accessible location for each
+    resource. Set `'resolve': true` to include the full path or URL of each
+    location, or `'resolve': 'probe'` to also check that neurobank paths exist
+    (`path` is null if the file can't be found or the archive is unavailable).
+    Set `'after': '<name>'` to resume an interrupted stream. Names can also be
+    streamed as `application/x-ndjson` with the options in the query string
+    (see bulk_resource_list).
 
     """
     if (resp := check_bulk_args(request)) is not None:
         return resp
-    query = Q()
-    for name in request.data.pop("names"):
-        query |= Q(name=name)
-    qs = models.Resource.objects.filter(query).select_related("dtype")
-    renderer = JSONLRenderer()
-
-    def gen(qs):
-        for resource in qs:
-            lqs = LocationFilter(
-                request.data, resource.location_set.order_by("archive__accessibility")
-            ).qs
-            if not lqs.exists():
-                continue
-            if resource.dtype.downloadable and len(request.data) == 0:
-                lqs = add_virtual_registry_location(request, resource, lqs)
-            yield renderer.render(
-                {
-                    "name": resource.name,
-                    "sha1": resource.sha1,
-                    "filename": resource.filename(),
-                    "locations": serializers.LocationSerializer(lqs, many=True).data,
-                }
+    names, options = bulk_params(request)
+    after = options.get("after")
+    best = is_true(options.get("best", False))
+    resolver = location_resolver(options.get("resolve"))
+    if not best and not location_filters_applied(options):
+        registry_location = registry_location_template(request)
+    else:
+        registry_location = None
+    renderer = renderers.record_renderer(request)
+
+    def chunk_locations(chunk):
+        lqs = LocationFilter(
+            options, models.Location.objects.filter(resource__name__in=chunk)
+        ).qs.select_related("archive", "resource")
+        lqs = lqs.annotate(resource_name=name_order("resource__name"))
+        lqs = lqs.order_by("resource_name", "archive__accessibility", "id")
+        if best:
+            # SELECT DISTINCT ON keeps the first row for each resource
+            lqs = lqs.distinct("resource_name")
+        return lqs
+
+    def gen(names):
+        for chunk in bulk_name_chunks(request, names, after):
+            records = itertools.groupby(
+                chunk_locations(chunk), key=lambda loc: loc.resource_id
             )
+            for _, group in records:
+                group = list(group)
+                resource = group[0].resource
+                locations = serializers.LocationSerializer(group, many=True).data
+                if registry_location is not None and resource.downloadable:
+                    locations.append(
+                        registry_location | {"resource_name": resource.name}
+                    )
+                if resolver is not None:
+                    locations = [resolver(loc) for loc in locations]
+                yield (
+                    resource.name,
+                    {
+                        "name": resource.name,
+                        "sha1": resource.sha1,
+                        "filename": resource.filename,
+                        "locations": locations,
+                    },
+                )
+
+    chunks = bulk_stream(gen(names), renderer, after)
+    return streaming.streaming_response(
+        request,
+        guards.guarded_stream(request, chunks),
+        content_type=renderer.media_type,
+    )
+
+
+@api_view(["GET"])
+@renderer_classes(renderers.STREAM_RENDERER_CLASSES)
+def change_list(request, format=None):
+    """Stream the log of changes to resources and locations, oldest first.
+
+    Use `?after=<seq>` to retrieve only the changes after the last sequence
+    number you received, and `?limit=<n>` to limit the number of records.
+    Streams results as line-delimited JSON records.
+
+    """
+    try:
+        after = int(request.query_params.get("after", 0))
+        limit = request.query_params.get("limit")
+        limit = None if limit is None else int(limit)
+    except ValueError:
+        return Response(
+            {"detail": "'after' and 'limit' must be integers"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if limit is not None and limit < 1:
+        return Response(
+            {"detail": "'limit' must be at least 1"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    qs = models.Change.objects.filter(id__gt=after).order_by("id")
+    if limit is not None:
+        qs = qs[:limit]
+    renderer = renderers.record_renderer(request)
+    gen = (
+        renderer.render(serializers.ChangeSerializer(obj).data) for obj in qs.iterator()
+    )
+    return streaming.streaming_response(request, gen, content_type=renderer.media_type)
+
 
-    return StreamingHttpResponse(gen(qs))
+class BulkMetadataUpdate(generics.GenericAPIView):
+    """Apply the same metadata changes to many resources.
+
+    PATCH {'metadata': {'key': 'value', ...}, 'names': ['name1', 'name2', ...]}
+    to update the named resources. Instead of (or in addition to) `names`, the
+    resources can be selected with the same query params as the resource list,
+    e.g. `?dtype=spike_times&metadata__experimenter=dmeliza`. As with updates to
+    individual resources, keys set to None are removed. The changes are applied
+    in a single UPDATE statement. Returns the number of resources updated.
+
+    """
+
+    queryset = models.Resource.objects.all()
+    filter_backends = (filters.DjangoFilterBackend,)
+    filterset_class = ResourceFilter
+    permission_classes = (permissions.DjangoModelPermissions,)
+
+    def filter_queryset(self, queryset):
+        qs = super().filter_queryset(queryset)
+        return filter_metadata(qs, self.request.query_params)
+
+    def has_selectors(self, request):
+        """True if the query params select a subset of the resources.
+
+        The filterset ignores params with empty values, so `?name=` alone
+        would select every resource. Metadata filters are always applied.
+
+        """
+        backend = filters.DjangoFilterBackend()
+        filterset = backend.get_filterset(request, self.get_queryset(), self)
+        if filterset is None or not filterset.is_valid():
+            return False
+        return any(
+            value not in EMPTY_VALUES for value in filterset.form.cleaned_data.values()
+        ) or any(key.startswith("metadata__") for key in request.query_params)
+
+    def patch(self, request, *args, **kwargs):
+        patch = request.data.get("metadata")
+        if not isinstance(patch, dict) or len(patch) == 0:
+            return Response(
+                {"detail": "usage: {'metadata': {'key': 'value', ...}}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        names = request.data.get("names")
+        if names is not None and not (
+            isinstance(names, list) and all(isinstance(name, str) for name in names)
+        ):
+            return Response(
+                {"detail": "names must be a list of strings"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        # raises ValidationError if the query params are invalid
+        qs = self.filter_queryset(self.get_queryset())
+        if not names and not self.has_selectors(request):
+            return Response(
+                {
+                    "detail": "must supply a list of names or query params to select resources"
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if names:
+            qs = qs.filter(name__in=names)
+        if has_designed_filters(request.query_params):
+            guards.check_query_cost(request, qs)
+        # joins on locations can repeat resources
+        selected = models.Resource.objects.filter(pk__in=qs.values("pk"))
+        with guards.timeout_guard(request), transaction.atomic():
+            # the changes are recorded first, because the update can change
+            # which resources match metadata filters
+            models.Change.lock_log()
+            models.Change.record_all(models.Change.Action.RESOURCE_UPDATED, selected)
+            count = selected.update(
+                metadata=metadata_patch(patch), modified_on=timezone.now()
+            )
+        return Response({"updated": count})